@@ -1,21 +1,46 @@
-from typing import List, TypedDict
+import asyncio
+import csv
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from typing import List, Literal, TypedDict
 from datetime import datetime
 
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
 from langchain.agents import AgentExecutor, create_openai_functions_agent
 from langchain.tools import tool
 from langchain_openai import ChatOpenAI
 from langchain_community.utilities import SQLDatabase
-from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
 from langgraph.graph import StateGraph, END
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+import dates
+import fulltext
+import normalization
+import script
+from cache import LRUCache
+from history import HistoryManager
+from intent import IntentClassifier
+from sql_guard import validate_sql, run_limited, truncate_rows
+from result_shaping import DirectAnswerRenderer, shape_result
 
 
 load_dotenv()
 
+class RouteDecision(BaseModel):
+    """Answers the user's last message: a SQLite query for a database question, or a reply for anything else."""
+    intent: Literal["DatabaseQuery", "Conversation"]
+    query: str = Field(default="", description="The SQLite query, when intent is DatabaseQuery.")
+    reply: str = Field(default="", description="The reply to the user, when intent is Conversation.")
+
 class DatabaseQuery(BaseModel):
     """The user is asking a question that requires a database query, or can be solved by an sql query"""
     pass
@@ -28,26 +53,382 @@ class Conversation(BaseModel):
 class AgentState(TypedDict):
     question: str
     chat_history: List[BaseMessage]
+    # Checkpointed sessions only: the rolling summary of the messages before chat_history.
+    history_summary: str
     query: str 
     result: str
     answer: str
     retries: int
     intent: str
+    cache_hit: bool
+    # The query cache entry a cache hit came from, which may be a near-duplicate question's.
+    cache_key: tuple
+    limit: str
+    result_id: str
+    direct_answer: str
+
+class SchemaCache:
+    """
+    Holds the schema prompt rendered for the current `script.schema_version`.
+    `get_table_info` reflects every table and runs sample-row SELECTs, so it is
+    built once per sync and shared by every request and retry. The FTS5 tables
+    (see fulltext) are described in a section of their own rather than as
+    regular tables. The canonical values (see normalization) and date ranges
+    (see dates) follow the data, so those sections are rebuilt when
+    `script.data_generation` changes, and when the date (`dates.today()`)
+    does, since the dates section states it.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.version = None
+        self.table_info = None
+        self.tables = {}
+        self.fulltext_tables = {}
+        self.value_sections_generation = None
+        self.value_sections = ""
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        version, generation = script.schema_version, (script.data_generation, dates.today())
+        with self._lock:
+            if self.version == version:
+                self.hits += 1
+                if self.value_sections_generation != generation:
+                    self._refresh_value_sections(generation)
+                return
+
+            self.misses += 1
+            connection = self.engine.raw_connection()
+            try:
+                cursor = connection.cursor()
+                fulltext_tables = fulltext.fulltext_tables(cursor)
+                hidden_tables = fulltext.hidden_tables(cursor, fulltext_tables)
+            finally:
+                connection.close()
+
+            # A fresh SQLDatabase, since its table list is fixed when it is created.
+            database = SQLDatabase(engine=self.engine, ignore_tables=list(hidden_tables))
+            self.table_info = database.get_table_info() + fulltext.describe(fulltext_tables)
+            inspector = inspect(self.engine)
+            self.tables = {
+                table: [column["name"] for column in inspector.get_columns(table)]
+                for table in database.get_usable_table_names()
+            }
+            self.fulltext_tables = {fts: columns for fts, columns in fulltext_tables.values()}
+            self.version = version
+            self._refresh_value_sections(generation)
+
+    def _refresh_value_sections(self, generation):
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            self.value_sections = normalization.describe(cursor, self.tables, script.value_normalizer) + dates.describe(cursor, self.tables)
+        finally:
+            connection.close()
+        self.value_sections_generation = generation
+
+    def get(self):
+        """The schema prompt: CREATE TABLE statements with a few sample rows."""
+        self._refresh()
+        return self.table_info + self.value_sections
+
+    def get_tables(self, include_fulltext=False):
+        """Table name -> column names, with the FTS tables too if `include_fulltext`."""
+        self._refresh()
+        return {**self.tables, **self.fulltext_tables} if include_fulltext else self.tables
+
+    def stats(self):
+        return {"version": self.version, "hits": self.hits, "misses": self.misses}
+
+# Words that change how a question is phrased but not which rows it asks for.
+FILLER_WORDS = {
+    "a", "all", "an", "any", "are", "can", "could", "do", "does", "find", "get", "give",
+    "i", "is", "list", "me", "of", "please", "show", "tell", "the", "there", "to", "us",
+    "what", "which", "you",
+}
+
+def normalize_question(question: str) -> str:
+    return " ".join(re.findall(r"[\w.@'-]+", question.lower()))
+
+def _content_words(normalized: str):
+    """The non-filler words in order, singular; order matters ("by john to priya" is not "by priya to john")."""
+    return tuple(word.rstrip("s") for word in normalized.split() if word not in FILLER_WORDS)
+
+def _trigrams(normalized: str):
+    padded = "  " + " ".join(word for word in normalized.split() if word not in FILLER_WORDS) + " "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def history_fingerprint(chat_history: List[BaseMessage], turns: int) -> str:
+    """Hashes the last `turns` messages, since follow-up questions only make sense in their context."""
+    recent = chat_history[-turns:] if turns else []
+    digest = hashlib.sha1()
+    for message in recent:
+        digest.update(f"{message.type}:{message.content}\n".encode())
+    return digest.hexdigest()
+
+class QueryCache:
+    """
+    Maps a question to SQL that already ran successfully for it, so repeated
+    questions skip intent classification and SQL generation.
+
+    Entries are keyed on the normalized question plus a fingerprint of the
+    recent chat history. A near-duplicate hit needs the same content words in
+    the same order (ignoring filler like "show me" and plurals) and a character-trigram
+    Jaccard similarity of at least `similarity` between them, so "pending tasks
+    for john" never answers "pending tasks for jane". Everything is dropped
+    when the schema changes.
+    """
+
+    def __init__(self, maxsize=256, similarity=0.75, history_turns=2):
+        self.entries = LRUCache(maxsize)
+        self.similarity = similarity
+        self.history_turns = history_turns
+        self.near_hits = 0
+        self.invalidations = 0
+        self.version = script.schema_version
+        self._lock = threading.Lock()
+
+    def _check_version(self):
+        with self._lock:
+            if self.version != script.schema_version:
+                self.entries.clear()
+                self.version = script.schema_version
+                self.invalidations += 1
+
+    def _key(self, question, chat_history):
+        return (history_fingerprint(chat_history, self.history_turns), normalize_question(question))
+
+    def lookup(self, question: str, chat_history: List[BaseMessage]):
+        """
+        Returns `(key, query)` for the entry that answers the question, an
+        exact or a near-duplicate hit, or `(None, None)`. `key` is what to
+        `discard` if the query turns out to fail.
+        """
+        self._check_version()
+        key = self._key(question, chat_history)
+        entry = self.entries.get(key)
+        if entry is not None:
+            return key, entry["query"]
+
+        fingerprint, normalized = key
+        words, trigrams = _content_words(normalized), _trigrams(normalized)
+        best_key, best_entry, best_score = None, None, self.similarity
+        for other_key, other in self.entries.items():
+            if other_key[0] != fingerprint or other["words"] != words:
+                continue
+            score = len(trigrams & other["trigrams"]) / len(trigrams | other["trigrams"])
+            if score >= best_score:
+                best_key, best_entry, best_score = other_key, other, score
+
+        if best_entry is None:
+            return None, None
+        self.entries.touch(best_key)
+        self.near_hits += 1
+        return best_key, best_entry["query"]
+
+    def store(self, question: str, chat_history: List[BaseMessage], query: str):
+        self._check_version()
+        key = self._key(question, chat_history)
+        normalized = key[1]
+        self.entries.put(key, {
+            "query": query,
+            "words": _content_words(normalized),
+            "trigrams": _trigrams(normalized),
+        })
 
-engine = create_engine("sqlite:///sheets.db")
-db = SQLDatabase(engine=engine) 
+    def discard(self, key):
+        self.entries.pop(key)
+
+    def stats(self):
+        stats = self.entries.stats()
+        lookups = stats["hits"] + stats["misses"]
+        stats["exact_hits"] = stats.pop("hits")
+        stats["near_hits"] = self.near_hits
+        stats["misses"] -= self.near_hits
+        stats["hit_rate"] = round((stats["exact_hits"] + self.near_hits) / lookups, 3) if lookups else 0.0
+        stats["invalidations"] = self.invalidations
+        return stats
+
+def normalize_sql(sql: str) -> str:
+    """Collapses whitespace outside string literals and quoted names, and drops trailing semicolons."""
+    sql = re.sub(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""", lambda m: m.group(1) or " ", sql.strip())
+    return sql.rstrip("; ")
+
+class ResultCache:
+    """
+    Remembers the output of successful queries for the current
+    `script.data_generation`, so identical SQL is not re-run until a sync
+    actually changes the data. Entries are `(result, direct_answer)` pairs.
+    """
+
+    def __init__(self, maxsize=128):
+        self.entries = LRUCache(maxsize)
+        self.generation = script.data_generation
+        self._lock = threading.Lock()
+
+    def _key(self, query):
+        generation = script.data_generation
+        with self._lock:
+            if self.generation != generation:
+                self.entries.clear()
+                self.generation = generation
+        return (generation, normalize_sql(query))
+
+    def get(self, query: str):
+        return self.entries.get(self._key(query))
+
+    def put(self, query: str, result: str, generation: int, direct_answer=None):
+        if "Error:" not in result and generation == script.data_generation:
+            self.entries.put((generation, normalize_sql(query)), (result, direct_answer))
+
+    def stats(self):
+        return dict(self.entries.stats(), generation=self.generation)
+
+# Per-connection read settings for the agent's pool; see `create_read_engine`.
+READ_POOL_SIZE = int(os.getenv("READ_POOL_SIZE", "8"))
+READ_CACHE_KB = int(os.getenv("READ_CACHE_KB", "16384"))
+READ_MMAP_BYTES = int(os.getenv("READ_MMAP_BYTES", str(256 * 1024 * 1024)))
+READ_BUSY_TIMEOUT_MS = int(os.getenv("READ_BUSY_TIMEOUT_MS", "5000"))
+
+def create_read_engine(path: str):
+    """
+    A pool of read-only connections to the sheets database.
+
+    Connections are opened with `mode=ro` and `query_only`, so nothing the
+    agent runs can write. The database is in WAL mode (set by the sync), so
+    these readers keep reading the last committed snapshot while a sync
+    writes, instead of failing with "database is locked".
+    """
+    read_engine = create_engine(
+        f"sqlite:///file:{path}?mode=ro&uri=true",
+        pool_size=READ_POOL_SIZE,
+        max_overflow=READ_POOL_SIZE,
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(read_engine, "connect")
+    def configure(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only = ON")
+        # Negative sizes are in KiB rather than pages.
+        cursor.execute(f"PRAGMA cache_size = -{READ_CACHE_KB}")
+        cursor.execute(f"PRAGMA mmap_size = {READ_MMAP_BYTES}")
+        cursor.execute(f"PRAGMA busy_timeout = {READ_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+    return read_engine
+
+engine = create_read_engine("sheets.db")
+schema_cache = SchemaCache(engine)
 llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-execute_query_tool = QuerySQLDatabaseTool(db=db)
+
+# Limits on a single generated query; hitting one sends the query back to the generator.
+# Results below them that are too large for the summarizer are shaped into a digest.
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "5"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "50000"))
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Largest result passed to the summarizer as is; see `result_shaping`.
+RESULT_PROMPT_ROWS = int(os.getenv("RESULT_PROMPT_ROWS", "50"))
+RESULT_PROMPT_CHARS = int(os.getenv("RESULT_PROMPT_CHARS", "6000"))
+# Shaped results kept for download at /results/{result_id}; 0 turns downloads off.
+# Each one is spilled to a CSV file in a temporary directory with its values
+# uncut, and the cache only holds the path, so memory stays flat however large
+# the results are. The file is deleted when its entry is evicted.
+result_downloads_dir = tempfile.TemporaryDirectory(prefix="sheet-results-")
+
+def _remove_download(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+result_downloads = LRUCache(maxsize=int(os.getenv("RESULT_DOWNLOADS", "32")), on_evict=_remove_download)
+
+# Result shapes answered from a template instead of the summarizer ("" turns this off).
+direct_answers = DirectAnswerRenderer(
+    shapes=[shape for shape in os.getenv("DIRECT_ANSWERS", "scalar,table,empty").split(",") if shape],
+    max_rows=int(os.getenv("DIRECT_ANSWER_MAX_ROWS", "5")),
+    max_columns=int(os.getenv("DIRECT_ANSWER_MAX_COLUMNS", "3")),
+    templates={
+        shape: os.getenv(f"DIRECT_ANSWER_{shape.upper()}_TEMPLATE")
+        for shape in ("scalar", "table", "empty")
+        if os.getenv(f"DIRECT_ANSWER_{shape.upper()}_TEMPLATE")
+    },
+)
+result_cache = ResultCache(maxsize=int(os.getenv("RESULT_CACHE_SIZE", "128")))
+# How classification and SQL generation are laid out in the graph; see `build_graph`.
+AGENT_TOPOLOGY = os.getenv("AGENT_TOPOLOGY", "split")
+
+# The local classifier answers confident cases; the rest go to the LLM classifier.
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "1") == "1"
+intent_classifier = IntentClassifier(
+    confidence=float(os.getenv("INTENT_CONFIDENCE", "0.9")),
+    schema_confidence=float(os.getenv("INTENT_SCHEMA_CONFIDENCE", "0.8")),
+    max_learned=int(os.getenv("INTENT_MAX_LEARNED", "2000")),
+)
+query_cache = QueryCache(
+    maxsize=int(os.getenv("QUERY_CACHE_SIZE", "256")),
+    similarity=float(os.getenv("QUERY_CACHE_SIMILARITY", "0.75")),
+    history_turns=int(os.getenv("QUERY_CACHE_HISTORY_MESSAGES", "2")),
+)
+
+def _build_history_summary_runnable():
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "Summarize the conversation below in at most five sentences. Keep the names, filters, dates and numbers the user may refer back to."),
+        ("human", "Summary so far: {summary}\n\nNew messages:\n{messages}")
+    ])
+
+    return prompt | llm
+
+history_summary_runnable = _build_history_summary_runnable()
+
+def summarize_history(previous_summary, messages: List[BaseMessage]) -> str:
+    """Folds `messages` into the rolling summary of the turns before them."""
+    return history_summary_runnable.invoke({
+        "summary": previous_summary or "(none yet)",
+        "messages": "\n".join(f"{message.type}: {message.content}" for message in messages),
+    }).content
+
+# Per node: at most this many recent messages and tokens of chat history.
+# Nodes in HISTORY_SUMMARY_NODES also get a summary of the older turns.
+HISTORY_BUDGETS = {
+    "classify_intent": (4, 400),
+    "generate_query": (6, 1200),
+    "route_question": (6, 1200),
+    "handle_conversation": (12, 2000),
+}
+HISTORY_SUMMARY_NODES = ("generate_query", "route_question", "handle_conversation")
+history_manager = HistoryManager(
+    HISTORY_BUDGETS,
+    summarize=summarize_history if os.getenv("HISTORY_SUMMARY", "1") == "1" else None,
+    summary_nodes=HISTORY_SUMMARY_NODES,
+)
+
+def _history(state: AgentState, node: str) -> List[BaseMessage]:
+    return history_manager.window(state.get("chat_history", []), node, state.get("history_summary"))
 
 @tool
 def get_current_datetime() -> str:
     """Returns today's date and the current time in ISO 8601 format."""
     return datetime.now().isoformat()
 
-def classify_intent_node(state: AgentState):
-    """Classifies the user's question by forcing the LLM to call a specific tool."""
-    print("--- Classifying Intent (with Function Calling) ---")
+def lookup_cached_query_node(state: AgentState):
+    """Reuses SQL that already answered this question, skipping classification and generation."""
+    key, query = query_cache.lookup(state["question"], state.get("chat_history", []))
+    if query is None:
+        return {"cache_hit": False}
+
+    print(f"--- Reusing cached SQL Query ---\nCached Query: {query}")
+    return {"cache_hit": True, "cache_key": key, "intent": "DatabaseQuery", "query": query, "retries": 0}
 
+def decide_cache_path(state: AgentState):
+    return "execute_query" if state.get("cache_hit") else "classify_intent"
+
+def _build_classify_intent_runnable():
     prompt = ChatPromptTemplate.from_messages([
         ("system", "You are an intent classifier. Call the appropriate tool based on the user's last message."),
         MessagesPlaceholder(variable_name="chat_history"),
@@ -56,32 +437,76 @@ def classify_intent_node(state: AgentState):
 
     tools = [DatabaseQuery, Conversation]
     llm_with_tools = llm.bind_tools(tools)
-    runnable = prompt | llm_with_tools
+    return prompt | llm_with_tools
 
-    ai_message = runnable.invoke({
-        "question": state['question'],
-        "chat_history": state.get("chat_history", []),
-    })
+classify_intent_runnable = _build_classify_intent_runnable()
 
+def _intent_from_message(ai_message):
     if not ai_message.tool_calls:
         intent = "Conversation"
     else:
         intent = ai_message.tool_calls[0]['name']
-    
+
     print(f"Intent: {intent}")
     return {'intent': intent}
 
+def _local_intent(state: AgentState, tables):
+    if not INTENT_FAST_PATH:
+        return None
+    intent = intent_classifier.classify(state['question'], state.get("chat_history", []), tables)
+    if intent:
+        print(f"Intent (local): {intent}")
+    return intent
+
+def _llm_intent(state: AgentState, ai_message, start: float):
+    update = _intent_from_message(ai_message)
+    intent_classifier.learn(state['question'], update['intent'])
+    intent_classifier.record("llm", time.perf_counter() - start)
+    return update
+
+def classify_intent_node(state: AgentState):
+    """
+    Classifies the user's question. Confident cases are decided locally by
+    `intent_classifier`; the rest by forcing the LLM to call a specific tool.
+    """
+    print("--- Classifying Intent (with Function Calling) ---")
+
+    start = time.perf_counter()
+    intent = _local_intent(state, schema_cache.get_tables())
+    if intent:
+        intent_classifier.record("local", time.perf_counter() - start)
+        return {'intent': intent}
+
+    ai_message = classify_intent_runnable.invoke({
+        "question": state['question'],
+        "chat_history": _history(state, "classify_intent"),
+    })
+    return _llm_intent(state, ai_message, start)
+
+async def aclassify_intent_node(state: AgentState):
+    """Async variant of `classify_intent_node`."""
+    print("--- Classifying Intent (with Function Calling) ---")
+
+    start = time.perf_counter()
+    # Reading the schema can hit SQLite after a sync, so it runs in a worker thread.
+    intent = _local_intent(state, await asyncio.to_thread(schema_cache.get_tables))
+    if intent:
+        intent_classifier.record("local", time.perf_counter() - start)
+        return {'intent': intent}
+
+    ai_message = await classify_intent_runnable.ainvoke({
+        "question": state['question'],
+        "chat_history": _history(state, "classify_intent"),
+    })
+    return _llm_intent(state, ai_message, start)
+
 def decide_intent_path(state: AgentState): 
     if state["intent"] == "DatabaseQuery":
         return "generate_query"
     else: 
         return "handle_conversation"
 
-def handle_conversation_node(state: AgentState):
-    """Creates natural conversation with the user"""
-
-    print("--- Handling Conversation ---")
-
+def _build_conversation_executor():
     prompt = ChatPromptTemplate.from_messages([
         ('system', "You are a friendly assisstant. Reply the user politely, with a relevant response."),
         MessagesPlaceholder(variable_name="chat_history"),
@@ -93,24 +518,35 @@ def handle_conversation_node(state: AgentState):
 
     agent_runnable = create_openai_functions_agent(llm, tools, prompt)
 
-    agent_excutor = AgentExecutor(agent=agent_runnable, tools=tools, verbose=True)
+    return AgentExecutor(agent=agent_runnable, tools=tools, verbose=False)
+
+conversation_executor = _build_conversation_executor()
+
+def handle_conversation_node(state: AgentState):
+    """Creates natural conversation with the user"""
+
+    print("--- Handling Conversation ---")
 
-    answer = agent_excutor.invoke({
+    answer = conversation_executor.invoke({
         "question": state["question"],
-        "chat_history": state.get("chat_history", [])
+        "chat_history": _history(state, "handle_conversation")
     })
     print(f"Final Answer: {answer['output']}")
     return {"answer": answer['output']}
 
-def generate_query_node(state: AgentState):
-    """
-    Takes the user's question and chat history, generates a SQL query,
-    and adds it to the state, based on provided schema.
-    """
+async def ahandle_conversation_node(state: AgentState):
+    """Async variant of `handle_conversation_node`."""
 
-    print("--- Generating SQL Query ---")
+    print("--- Handling Conversation ---")
 
-    system_prompt = """You are an AI expert in writing SQLite queries.
+    answer = await conversation_executor.ainvoke({
+        "question": state["question"],
+        "chat_history": _history(state, "handle_conversation")
+    })
+    print(f"Final Answer: {answer['output']}")
+    return {"answer": answer['output']}
+
+SQL_SYSTEM_PROMPT = """You are an AI expert in writing SQLite queries.
     Given a user question and conversation history, create a syntactically correct SQLite query.
     The query should work on the given schema.
     {schema}
@@ -123,13 +559,24 @@ def generate_query_node(state: AgentState):
     - The "Status" column: 'Completed', 'Yes', 'Done' all mean the task is complete.
     - The "Priority" column: 'High', 'Urgent', 'H' all mean high priority. 'Low' and 'L' mean low priority.
     - The "Assignee" column: Usernames like 'john.doe' and 'johnd' should be treated as the same person.
+    - When a column has a "_canonical" companion listed under Canonical Values, these spellings are already folded into it: filter on the companion with =.
     -----------------------
 
     - Only return the SQL query. Do not add any other text or explaination.
     - **IMPORTANT:** If a column name contains a space, you MUST wrap it in double quotes. For example: "Task Description".
     """
 
-    if "Error:" in state.get('result', ''):
+# The merged topology's single call: classify and, for database questions, write the SQL.
+ROUTE_SYSTEM_PROMPT = """You answer messages for a Google Sheets assistant and decide whether the user's last message needs the database.
+    - If it does, set intent to "DatabaseQuery" and put a SQLite query for it in `query`, following the instructions below.
+    - Otherwise set intent to "Conversation" and reply to the user politely in `reply`. The current date and time is {now}.
+
+    """ + SQL_SYSTEM_PROMPT
+
+def _build_generate_query_runnable(fix_error: bool):
+    system_prompt = SQL_SYSTEM_PROMPT
+
+    if fix_error:
 
         system_prompt += """
         \n---
@@ -145,21 +592,193 @@ def generate_query_node(state: AgentState):
         ("human", "{question}")
     ])
 
-    runnable = prompt | llm
+    return prompt | llm
+
+generate_query_runnable = _build_generate_query_runnable(fix_error=False)
+fix_query_runnable = _build_generate_query_runnable(fix_error=True)
 
-    raw_query = runnable.invoke({
+def _generate_query_runnable(state: AgentState):
+    """The generator prompt, with the failed query's error when this is a retry."""
+    return fix_query_runnable if "Error:" in state.get('result', '') else generate_query_runnable
+
+def _generate_query_inputs(state: AgentState):
+    return {
         "question": state['question'],
-        "chat_history": state.get("chat_history", []),
-        "schema": db.get_table_info(),
+        "chat_history": _history(state, "generate_query"),
+        "schema": schema_cache.get(),
         "error": state.get("result", '')
-    }).content
+    }
 
+def _query_update(state: AgentState, raw_query: str):
     sql_query = raw_query.strip().replace("```sql", "").replace("```", "").strip()
 
     print(f"Generated Query: {sql_query}")
     retries = state.get("retries", 0)
 
-    return {"query": sql_query, "retries": retries + 1}
+    return {"query": sql_query, "retries": retries + 1, "cache_hit": False}
+
+def generate_query_node(state: AgentState):
+    """
+    Takes the user's question and chat history, generates a SQL query,
+    and adds it to the state, based on provided schema.
+    """
+
+    print("--- Generating SQL Query ---")
+
+    raw_query = _generate_query_runnable(state).invoke(_generate_query_inputs(state)).content
+    return _query_update(state, raw_query)
+
+async def agenerate_query_node(state: AgentState):
+    """Async variant of `generate_query_node`. A schema cache miss reflects in a worker thread."""
+
+    print("--- Generating SQL Query ---")
+
+    inputs = await asyncio.to_thread(_generate_query_inputs, state)
+    raw_query = (await _generate_query_runnable(state).ainvoke(inputs)).content
+    return _query_update(state, raw_query)
+
+def _build_route_runnable():
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", ROUTE_SYSTEM_PROMPT),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{question}")
+    ])
+
+    return prompt | llm.with_structured_output(RouteDecision, method="function_calling")
+
+route_runnable = _build_route_runnable()
+
+def _route_inputs(state: AgentState):
+    return {
+        "question": state['question'],
+        "chat_history": _history(state, "route_question"),
+        "schema": schema_cache.get(),
+        "now": datetime.now().isoformat(),
+    }
+
+def _route_update(state: AgentState, decision: RouteDecision, start: float):
+    intent_classifier.learn(state['question'], decision.intent)
+    intent_classifier.record("llm", time.perf_counter() - start)
+    print(f"Intent: {decision.intent}")
+
+    if decision.intent == "DatabaseQuery":
+        if not decision.query.strip():
+            return {"intent": "DatabaseQuery", "query": "", "answer": ""}
+        return {"intent": "DatabaseQuery", "answer": "", **_query_update(state, decision.query)}
+    if decision.reply:
+        print(f"Final Answer: {decision.reply}")
+    return {"intent": "Conversation", "query": "", "answer": decision.reply}
+
+def _local_route(state: AgentState, tables, start: float):
+    intent = _local_intent(state, tables)
+    if intent:
+        intent_classifier.record("local", time.perf_counter() - start)
+        return {"intent": intent, "query": "", "answer": ""}
+    return None
+
+def route_question_node(state: AgentState):
+    """
+    The merged topology's replacement for classify_intent + generate_query:
+    one structured-output call returns either the SQL query or the reply.
+    Questions the local classifier is sure about skip it and go to the
+    regular generate/conversation nodes.
+    """
+    print("--- Routing Question (classify + generate) ---")
+
+    start = time.perf_counter()
+    update = _local_route(state, schema_cache.get_tables(), start)
+    if update:
+        return update
+
+    decision = route_runnable.invoke(_route_inputs(state))
+    return _route_update(state, decision, start)
+
+async def aroute_question_node(state: AgentState):
+    """Async variant of `route_question_node`. Schema reads run in a worker thread."""
+    print("--- Routing Question (classify + generate) ---")
+
+    start = time.perf_counter()
+    update = _local_route(state, await asyncio.to_thread(schema_cache.get_tables), start)
+    if update:
+        return update
+
+    inputs = await asyncio.to_thread(_route_inputs, state)
+    decision = await route_runnable.ainvoke(inputs)
+    return _route_update(state, decision, start)
+
+def decide_route_path(state: AgentState):
+    if state["intent"] == "DatabaseQuery":
+        return "validate_query" if state.get("query") else "generate_query"
+    return "end" if state.get("answer") else "handle_conversation"
+
+def _validate(state: AgentState):
+    query, error = validate_sql(state['query'], schema_cache.get_tables(include_fulltext=True), engine)
+    if error:
+        print(f"Validation failed: {error}")
+        return {"query": query, "result": error}
+    return {"query": query, "result": ""}
+
+def validate_query_node(state: AgentState):
+    """
+    Repairs and compiles the generated SQL locally (see `sql_guard`), so a
+    broken query loops back to the generator without being executed.
+    """
+    print("--- Validating SQL Query ---")
+    return _validate(state)
+
+async def avalidate_query_node(state: AgentState):
+    """Async variant of `validate_query_node`. Compiling touches SQLite, so it runs in a worker thread."""
+    print("--- Validating SQL Query ---")
+    return await asyncio.to_thread(_validate, state)
+
+def decide_validation_path(state: AgentState):
+    if "Error:" in state["result"]:
+        return decide_result_status(state)
+    return "execute_query"
+
+def _remember_query(state: AgentState, result: str):
+    """Caches SQL that ran cleanly, and forgets a cached query that stopped working."""
+    failed = "Error:" in result
+    if failed and state.get("cache_hit"):
+        query_cache.discard(state["cache_key"])
+    elif not failed and not state.get("cache_hit"):
+        query_cache.store(state["question"], state.get("chat_history", []), state["query"])
+
+def _spill_download(result_id, columns, rows):
+    """Writes a result to a CSV file for /results/{result_id} and returns its path."""
+    path = os.path.join(result_downloads_dir.name, f"{result_id}.csv")
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    return path
+
+def run_query(query: str, generation: int):
+    """
+    Executes SQL within the query limits and records a clean result under the
+    data generation it was read at. Returns `(result, limit, result_id,
+    direct_answer)`: `limit` as in `run_limited`, the download id of a result
+    that was shaped into a digest (or ""), and the templated answer when the
+    result's shape allows one (or None).
+    """
+    columns, full_rows, error, limit = run_limited(
+        query, engine, QUERY_TIMEOUT_SECONDS, QUERY_MAX_ROWS, QUERY_MAX_BYTES, truncate=False,
+    )
+    if error:
+        return error, limit, "", None
+    script.index_advisor.record(query)
+
+    rows = truncate_rows(full_rows)
+    result, shaped = shape_result(columns, rows, RESULT_PROMPT_ROWS, RESULT_PROMPT_CHARS)
+    result_id = ""
+    if shaped:
+        print(f"Shaped a {len(rows):,}-row result into a digest")
+        if result_downloads.maxsize:
+            result_id = uuid.uuid4().hex
+            result_downloads.put(result_id, _spill_download(result_id, columns, full_rows))
+    direct_answer = direct_answers.render(columns, full_rows)
+    result_cache.put(query, result, generation, direct_answer)
+    return result, limit, result_id, direct_answer
 
 def execute_query_node(state: AgentState):
     """Executes the SQL query and returns the result."""
@@ -167,9 +786,35 @@ def execute_query_node(state: AgentState):
     print("--- Executing SQL Query ---")
 
     query = state['query']
-    result = execute_query_tool.invoke(query)
+    generation = script.data_generation
+    cached = result_cache.get(query)
+    if cached is None:
+        result, limit, result_id, direct_answer = run_query(query, generation)
+    else:
+        (result, direct_answer), limit, result_id = cached, None, ""
+    if limit:
+        print(f"Query hit the {limit} limit")
     print(f"Query Result: {result}")
-    return {"result": result}
+    _remember_query(state, result)
+    return {"result": result, "limit": limit or "", "result_id": result_id, "direct_answer": direct_answer or ""}
+
+async def aexecute_query_node(state: AgentState):
+    """Async variant of `execute_query_node`. Cache misses hit SQLite, which blocks, so they run in a worker thread."""
+
+    print("--- Executing SQL Query ---")
+
+    query = state['query']
+    generation = script.data_generation
+    cached = result_cache.get(query)
+    if cached is None:
+        result, limit, result_id, direct_answer = await asyncio.to_thread(run_query, query, generation)
+    else:
+        (result, direct_answer), limit, result_id = cached, None, ""
+    if limit:
+        print(f"Query hit the {limit} limit")
+    print(f"Query Result: {result}")
+    _remember_query(state, result)
+    return {"result": result, "limit": limit or "", "result_id": result_id, "direct_answer": direct_answer or ""}
 
 def decide_result_status(state: AgentState):
     """Checks the result for an error and decides the next step."""
@@ -180,16 +825,19 @@ def decide_result_status(state: AgentState):
             return "handle_error"
         else:
             return "generate_query"
+    elif state.get("direct_answer"):
+        return "answer_directly"
     else: 
         return "summarize_result"
-    
-def handle_error_node(state: AgentState):
-    """This node is called when the agent gives up."""
-    print("--- 😩 Agent failed after multiple retries ---")
-    question = state['question']
-    error = state.get("result", "Unknown error")
-    query = state['query']
 
+def answer_directly_node(state: AgentState):
+    """Answers from the template `execute_query` rendered, skipping the summarizer's LLM call."""
+    print("--- Answering Directly ---")
+    direct_answers.answered += 1
+    print(f"Final Answer: {state['direct_answer']}")
+    return {"answer": state["direct_answer"]}
+
+def _build_handle_error_runnable():
     error_prompt = ChatPromptTemplate.from_messages([
         ('system', "You are a helpful AI assistant the runs SQL database queries. Even after mulitple tries the query generated fails, address how the user should adjust there question so it can give valid results."),
         ('human', """Based on the user's question: "{question}"
@@ -199,25 +847,36 @@ def handle_error_node(state: AgentState):
         Please provide a clear, natural language answer.""")
     ])
 
-    runnable = error_prompt | llm 
+    return error_prompt | llm
 
-    answer = runnable.invoke({
-        "question": question,
-        "query": query,
-        "error": error
-    }).content 
+handle_error_runnable = _build_handle_error_runnable()
+
+def _handle_error_inputs(state: AgentState):
+    return {
+        "question": state['question'],
+        "query": state['query'],
+        "error": state.get("result", "Unknown error")
+    }
+
+def handle_error_node(state: AgentState):
+    """This node is called when the agent gives up."""
+    print("--- 😩 Agent failed after multiple retries ---")
+
+    answer = handle_error_runnable.invoke(_handle_error_inputs(state)).content 
 
     print(f"Final Answer: {answer}")
     return {"answer": answer}
 
-def summarize_result_node(state: AgentState):
-    """Takes the query result and the user's question and creates a natural language answer"""
+async def ahandle_error_node(state: AgentState):
+    """Async variant of `handle_error_node`."""
+    print("--- 😩 Agent failed after multiple retries ---")
 
-    print("--- Summarizing Result ---")
-    question = state['question']
-    result = state['result']
-    query = state['query']
+    answer = (await handle_error_runnable.ainvoke(_handle_error_inputs(state))).content 
 
+    print(f"Final Answer: {answer}")
+    return {"answer": answer}
+
+def _build_summarize_result_runnable():
     summarizer_prompt = ChatPromptTemplate.from_messages([
         ('system', "You are a helpful AI assistant. Your job is to answer the user's question based on the data provided."),
         ('human', """Based on the user's question: "{question}"
@@ -227,49 +886,209 @@ def summarize_result_node(state: AgentState):
         Please provide a clear, natural language answer.""")
     ])
 
-    runnable = summarizer_prompt | llm 
+    return summarizer_prompt | llm
 
-    answer = runnable.invoke({
-        "question": question,
-        "query": query,
-        "result": result
-    }).content 
+summarize_result_runnable = _build_summarize_result_runnable()
+
+def _summarize_result_inputs(state: AgentState):
+    return {
+        "question": state['question'],
+        "query": state['query'],
+        "result": state['result']
+    }
+
+def summarize_result_node(state: AgentState):
+    """Takes the query result and the user's question and creates a natural language answer"""
+
+    print("--- Summarizing Result ---")
+
+    answer = summarize_result_runnable.invoke(_summarize_result_inputs(state)).content 
 
     print(f"Final Answer: {answer}")
     return {"answer": answer}
 
+async def asummarize_result_node(state: AgentState):
+    """Async variant of `summarize_result_node`."""
+
+    print("--- Summarizing Result ---")
+
+    answer = (await summarize_result_runnable.ainvoke(_summarize_result_inputs(state))).content 
+
+    print(f"Final Answer: {answer}")
+    return {"answer": answer}
+
+def _node(func, afunc):
+    """Pairs a node with its async variant so the graph serves both `invoke` and `ainvoke`."""
+    return RunnableLambda(func, afunc=afunc, name=func.__name__)
+
+
+def build_graph(topology: str = AGENT_TOPOLOGY, checkpointer=None):
+    """
+    Compiles the agent graph. "split" classifies the intent and generates SQL
+    in two LLM calls; "merged" does both in one call (`route_question_node`).
+    The nodes after SQL generation are the same in both. With a
+    `checkpointer`, state persists per `thread_id` (see `next_turn`).
+    """
+    merged = topology == "merged"
+    builder = (StateGraph(AgentState)
+               .add_node("lookup_cached_query", lookup_cached_query_node)
+               .add_node("handle_conversation", _node(handle_conversation_node, ahandle_conversation_node))
+               .add_node("generate_query", _node(generate_query_node, agenerate_query_node))
+               .add_node("validate_query", _node(validate_query_node, avalidate_query_node))
+               .add_node("execute_query", _node(execute_query_node, aexecute_query_node))
+               .add_node("summarize_result", _node(summarize_result_node, asummarize_result_node))
+               .add_node("answer_directly", answer_directly_node)
+               .add_node("handle_error", _node(handle_error_node, ahandle_error_node))
+
+               .set_entry_point("lookup_cached_query")
+               .add_edge("generate_query", "validate_query")
+               .add_conditional_edges(
+                   source="validate_query",
+                   path=decide_validation_path,
+                   path_map={
+                       "execute_query": "execute_query",
+                       "generate_query": "generate_query",
+                       "handle_error": "handle_error",
+                   }
+               )
+               .add_conditional_edges(
+                   source="execute_query",
+                   path=decide_result_status,
+                   path_map={
+                       "generate_query": "generate_query",
+                       "summarize_result": "summarize_result",
+                       "answer_directly": "answer_directly",
+                       "handle_error": "handle_error",
+                   }
+               )
+               .add_edge("handle_conversation", END)
+               .add_edge("handle_error", END)
+               .add_edge("summarize_result", END)
+               .add_edge("answer_directly", END))
 
-graph = (StateGraph(AgentState)
-         .add_node("classify_intent", classify_intent_node)
-         .add_node("handle_conversation", handle_conversation_node)
-         .add_node("generate_query", generate_query_node)
-         .add_node("execute_query", execute_query_node)
-         .add_node("summarize_result", summarize_result_node)
-         .add_node("handle_error", handle_error_node)
-        
-         .set_entry_point("classify_intent")
+    if merged:
+        (builder
+         .add_node("route_question", _node(route_question_node, aroute_question_node))
          .add_conditional_edges(
-             source="classify_intent",
-             path=decide_intent_path,
+             source="lookup_cached_query",
+             path=decide_cache_path,
              path_map={
-                 "generate_query": "generate_query",
-                 "handle_conversation": "handle_conversation"
+                 "execute_query": "execute_query",
+                 "classify_intent": "route_question"
              }
          )
-         .add_edge("generate_query", "execute_query")
          .add_conditional_edges(
-             source="execute_query",
-             path=decide_result_status,
+             source="route_question",
+             path=decide_route_path,
              path_map={
+                 "validate_query": "validate_query",
                  "generate_query": "generate_query",
-                 "summarize_result": "summarize_result",
-                 "handle_error": "handle_error",
+                 "handle_conversation": "handle_conversation",
+                 "end": END,
+             }
+         ))
+    else:
+        (builder
+         .add_node("classify_intent", _node(classify_intent_node, aclassify_intent_node))
+         .add_conditional_edges(
+             source="lookup_cached_query",
+             path=decide_cache_path,
+             path_map={
+                 "execute_query": "execute_query",
+                 "classify_intent": "classify_intent"
              }
          )
-         .add_edge("handle_conversation", END)
-         .add_edge("handle_error", END)
-         .add_edge("summarize_result", END)
-         .compile())
+         .add_conditional_edges(
+             source="classify_intent",
+             path=decide_intent_path,
+             path_map={
+                 "generate_query": "generate_query",
+                 "handle_conversation": "handle_conversation"
+             }
+         ))
+
+    return builder.compile(checkpointer=checkpointer)
+
+# "split" (default) or "merged"; see `build_graph`.
+graph = build_graph()
+
+# A checkpointed session keeps at most this many messages of chat history;
+# older ones are folded into its history_summary.
+SESSION_HISTORY_MESSAGES = int(os.getenv("SESSION_HISTORY_MESSAGES", "100"))
+
+def next_turn(values: dict, question: str):
+    """
+    The input for a new turn of a checkpointed session, given the state the
+    last turn ended with: its question and answer move into `chat_history`
+    and the per-turn fields start over. Past SESSION_HISTORY_MESSAGES, the
+    oldest messages are folded into `history_summary` (see
+    `HistoryManager.fold`), which may call the LLM, so run it off the event loop.
+    """
+    chat_history = list(values.get("chat_history", []))
+    if values.get("question") and values.get("answer"):
+        chat_history += [HumanMessage(content=values["question"]), AIMessage(content=values["answer"])]
+    summary, chat_history = history_manager.fold(chat_history, values.get("history_summary", ""), SESSION_HISTORY_MESSAGES)
+
+    return {
+        "question": question,
+        "chat_history": chat_history,
+        "history_summary": summary or "",
+        "query": "",
+        "result": "",
+        "answer": "",
+        "retries": 0,
+        "intent": "",
+        "cache_hit": False,
+        "cache_key": None,
+        "limit": "",
+        "result_id": "",
+        "direct_answer": "",
+    }
+
+# Nodes whose LLM tokens make up the user-facing answer.
+ANSWER_NODES = {"summarize_result", "handle_conversation", "handle_error"}
+
+async def astream_answer(state: AgentState, agent_graph=None, config=None):
+    """
+    Runs the graph (`agent_graph`, by default the stateless one) and yields
+    `(event, data)` pairs: a progress event as each stage finishes, the answer
+    tokens as the model produces them, and finally the complete answer.
+    """
+    answer = None
+
+    async for mode, chunk in (agent_graph or graph).astream(state, config, stream_mode=["updates", "messages"]):
+        if mode == "messages":
+            message, metadata = chunk
+            if metadata.get("langgraph_node") in ANSWER_NODES and message.content:
+                yield "token", {"content": message.content}
+            continue
+
+        for node, update in chunk.items():
+            update = update or {}
+            if node == "lookup_cached_query" and update.get("cache_hit"):
+                yield "query", {"query": update["query"], "attempt": 0, "cached": True}
+            elif node == "classify_intent":
+                yield "intent", {"intent": update["intent"]}
+            elif node == "route_question":
+                yield "intent", {"intent": update["intent"]}
+                if update.get("query"):
+                    yield "query", {"query": update["query"], "attempt": update["retries"]}
+            elif node == "generate_query":
+                yield "query", {"query": update["query"], "attempt": update["retries"]}
+            elif node == "validate_query" and "Error:" in update["result"]:
+                yield "rows", {"status": "error", "error": update["result"]}
+            elif node == "execute_query":
+                failed = "Error:" in update["result"]
+                yield "rows", {
+                    "status": "error" if failed else "ok",
+                    "error": update["result"] if failed else None,
+                    "limit": update.get("limit") or None,
+                    "download": f"/results/{update['result_id']}" if update.get("result_id") else None,
+                }
+            if "answer" in update:
+                answer = update["answer"]
+
+    yield "answer", {"answer": answer or "Sorry, I encountered an error."}
 
 initial_state = {
     "question": "Aaj kya date?",
@@ -0,0 +1,90 @@
+"""
+Load benchmark for the /chat endpoint against a local fake LLM.
+
+Fires N concurrent database questions twice: once the way /chat used to run
+them (an `async def` handler calling the blocking `graph.invoke`) and once
+through the current endpoint, which awaits `graph.ainvoke`. With the blocking
+call the requests run one after another, so wall time grows with N; with the
+async path it stays close to a single request's latency.
+
+    python benchmarks/async_chat.py --requests 20 --latency 0.5
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm import use_fake_llm
+
+
+def questions(run, n):
+    """Questions no other run asks, so neither run is answered from the query or result cache."""
+    return [f"how many tasks are in {run} batch {i}" for i in range(n)]
+
+def reset_caches(agent):
+    """Empties the query, result and schema caches, so each run starts as cold as the first."""
+    agent.query_cache.entries.clear()
+    agent.result_cache.entries.clear()
+    agent.schema_cache.version = None
+
+async def run_blocking(graph, n):
+    """Reproduces the old handler: an async endpoint that calls `graph.invoke`."""
+    async def legacy_chat(question):
+        return graph.invoke({"question": question, "chat_history": []})
+
+    return await asyncio.gather(*(legacy_chat(question) for question in questions("blocking", n)))
+
+async def run_async(app, n):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        return await asyncio.gather(*(
+            client.post("/chat", json={"question": question, "chat_history": []})
+            for question in questions("async", n)
+        ))
+
+def timed(coro):
+    start = time.perf_counter()
+    asyncio.run(coro)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake LLM call")
+    args = parser.parse_args()
+
+    use_fake_llm(latency=args.latency)
+    os.chdir(tempfile.mkdtemp())
+    # Every request takes the full classify -> generate -> summarize path.
+    os.environ["INTENT_FAST_PATH"] = "0"
+    os.environ["DIRECT_ANSWERS"] = ""
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import script
+        script.write_to_sqlite({"Tasks": [{"TaskID": 1, "Status": "Pending"}]}, "sheets.db")
+        import agent
+        from main import app
+
+        reset_caches(agent)
+        blocking = timed(run_blocking(agent.graph, args.requests))
+        reset_caches(agent)
+        concurrent = timed(run_async(app, args.requests))
+
+    # classify + generate + summarize = 3 LLM calls per database question
+    per_request = 3 * args.latency
+    print(f"{args.requests} concurrent requests, {args.latency:.2f}s per LLM call (~{per_request:.2f}s per request)")
+    print(f"graph.invoke inside async def : {blocking:7.2f}s")
+    print(f"await graph.ainvoke           : {concurrent:7.2f}s")
+    print(f"speed-up                      : {blocking / concurrent:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
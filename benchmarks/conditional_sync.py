@@ -0,0 +1,110 @@
+"""
+Cost of a webhook-triggered sync when little or nothing changed.
+
+Serves a two-sheet Apps Script payload from a local HTTP stand-in and runs
+`sync_database` for the cases a webhook produces: the first sync, a
+formatting-only edit (identical payload) with and without fingerprints,
+an edit to one sheet, and an identical payload from a source that answers
+If-None-Match with 304. Each line shows the outcome, the sheets applied and
+skipped, whether cached query results were invalidated, and the time taken.
+
+    python benchmarks/conditional_sync.py --rows 200000
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import script
+
+
+def make_sheet(n, seed):
+    rng = random.Random(seed)
+    return [{
+        "TaskID": i,
+        "Task Description": f"Follow up on invoice {rng.randint(1000, 9999)} with vendor {rng.randint(1, 500)}",
+        "Assignee": f"user{rng.randint(1, 50)}",
+        "Status": rng.choice(["Pending", "Completed", "Done", "In Progress"]),
+        "Hours": round(rng.uniform(0.5, 40), 1),
+    } for i in range(1, n + 1)]
+
+class Source:
+    """The payload being served, and whether the server honours If-None-Match."""
+
+    def __init__(self, sheets):
+        self.etags = False
+        self.set(sheets)
+
+    def set(self, sheets):
+        self.body = json.dumps(sheets).encode()
+        self.etag = '"' + hashlib.md5(self.body).hexdigest() + '"'
+
+def serve(source):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if source.etags and self.headers.get("If-None-Match") == source.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(source.body)))
+            if source.etags:
+                self.send_header("ETag", source.etag)
+            self.end_headers()
+            self.wfile.write(source.body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/exec"
+
+def run(label):
+    generation = script.data_generation
+    with contextlib.redirect_stdout(io.StringIO()):
+        script.sync_database()
+    report = script.last_sync_report
+    invalidated = "yes" if script.data_generation != generation else "no"
+    print(f"{label:<28} {report['outcome']:<13} {report['sheets_applied']:>7} {report['sheets_skipped']:>7} "
+          f"{invalidated:>11} {report['seconds']:>8.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    script.INDEX_ADVISOR = False
+    sheets = {"Tasks": make_sheet(args.rows, 1), "Archive": make_sheet(args.rows // 4, 2)}
+    source = Source(sheets)
+    os.environ["APPS_SCRIPT_URL"] = serve(source)
+
+    print(f"{args.rows:,} + {args.rows // 4:,} rows")
+    print(f"{'':<28} {'outcome':<13} {'applied':>7} {'skipped':>7} {'invalidated':>11} {'time':>9}")
+    run("first sync")
+    # Forgetting the fingerprints gives the previous behaviour: a full row diff.
+    script._last_payload["fingerprint"] = None
+    script._sheet_fingerprints.clear()
+    run("formatting-only, row diff")
+    run("formatting-only edit")
+    sheets["Archive"][10]["Status"] = "Done"
+    source.set(sheets)
+    run("one sheet edited")
+    source.etags = True
+    run("no edit, first ETag")
+    run("no edit, If-None-Match")
+
+
+if __name__ == "__main__":
+    main()
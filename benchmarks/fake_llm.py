@@ -0,0 +1,135 @@
+"""
+A tiny OpenAI-compatible chat completions server for local benchmarks.
+
+Every call sleeps for a fixed latency before answering, so the benchmarks
+measure how the agent schedules LLM round-trips rather than model speed.
+The replies follow the agent's graph: the intent classifier gets a tool call
+(the merged topology's RouteDecision call gets `SELECT 1` or a reply in it),
+the SQL generator gets `SELECT 1` and everything else gets a short sentence.
+"""
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+from aiohttp import web
+
+
+def _last_user_message(messages):
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+def _reply_for(body):
+    messages = body.get("messages", [])
+    system = " ".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    question = _last_user_message(messages).lower()
+
+    if body.get("tools"):
+        name = "Conversation" if question.startswith(("hi", "hello", "thanks")) else "DatabaseQuery"
+        arguments = {}
+        if body["tools"][0]["function"]["name"] == "RouteDecision":
+            # The merged topology's single call carries the intent and its payload.
+            arguments = {"intent": name, "query": "SELECT 1", "reply": ""}
+            if name == "Conversation":
+                arguments.update(query="", reply="Hello! How can I help you today?")
+            name = "RouteDecision"
+        return {"content": None, "tool_calls": [{
+            "id": "call_0",
+            "type": "function",
+            "function": {"name": name, "arguments": json.dumps(arguments)},
+        }]}
+    if "SQLite queries" in system:
+        return {"content": "SELECT 1", "tool_calls": None}
+    return {"content": "There is exactly one matching row in the sheet.", "tool_calls": None}
+
+def _completion(body, reply):
+    message = {"role": "assistant", "content": reply["content"]}
+    if reply["tool_calls"]:
+        message["tool_calls"] = reply["tool_calls"]
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if reply["tool_calls"] else "stop",
+        }],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+def _chunk(body, delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "gpt-4o-mini"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+async def _stream(request, body, reply, token_delay):
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+
+    async def send(payload):
+        await response.write(f"data: {json.dumps(payload)}\n\n".encode())
+
+    await send(_chunk(body, {"role": "assistant", "content": ""}))
+    if reply["tool_calls"]:
+        tool_calls = [dict(call, index=i) for i, call in enumerate(reply["tool_calls"])]
+        await send(_chunk(body, {"tool_calls": tool_calls}))
+    else:
+        for word in reply["content"].split(" "):
+            await asyncio.sleep(token_delay)
+            await send(_chunk(body, {"content": word + " "}))
+    await send(_chunk(body, {}, "tool_calls" if reply["tool_calls"] else "stop"))
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+def _make_app(latency, token_delay):
+    async def chat_completions(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        reply = _reply_for(body)
+        if body.get("stream"):
+            return await _stream(request, body, reply, token_delay)
+        return web.json_response(_completion(body, reply))
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+def start_fake_llm(latency=0.5, token_delay=0.05):
+    """Starts the server on a free port in a background thread and returns its base URL."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    ready = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(_make_app(latency, token_delay))
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{port}/v1"
+
+def use_fake_llm(latency=0.5, token_delay=0.05):
+    """Starts the server and points the OpenAI client at it. Call before importing `agent`."""
+    base_url = start_fake_llm(latency, token_delay)
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_BASE"] = base_url
+    return base_url
@@ -0,0 +1,126 @@
+"""
+Text search latency, LIKE '%...%' scans versus the FTS5 index, and what the
+index costs at sync time.
+
+Syncs a synthetic text-heavy task sheet (long descriptions and notes) with
+FULLTEXT_INDEX off and on, times a one-cell edit on the indexed table, and
+runs the searches the SQL generator writes both ways: the LIKE form it used
+to emit and the MATCH form the schema prompt now asks for.
+
+    python benchmarks/fulltext_search.py --rows 200000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import script
+
+COMMON_WORDS = (
+    "follow up review with the for and send check update prepare call share confirm team client meeting "
+    "schedule draft report budget design approval next week today pending details notes"
+).split()
+# Topic words; each appears in a few percent of the rows or less.
+TOPIC_WORDS = (
+    "invoice vendor contract payment quarterly shipment warehouse audit compliance renewal onboarding "
+    "training migration server outage backlog estimate proposal campaign launch feedback survey refund escalation"
+).split()
+
+SEARCHES = [
+    (
+        "one word",
+        """SELECT COUNT(*) FROM Tasks WHERE "Task Description" LIKE '%invoice%'""",
+        """SELECT COUNT(*) FROM Tasks WHERE rowid IN (SELECT rowid FROM Tasks_fts WHERE "Task Description" MATCH 'invoice')""",
+    ),
+    (
+        "two words",
+        """SELECT COUNT(*) FROM Tasks WHERE "Task Description" LIKE '%refund%' AND "Task Description" LIKE '%escalation%'""",
+        """SELECT COUNT(*) FROM Tasks WHERE rowid IN (SELECT rowid FROM Tasks_fts WHERE "Task Description" MATCH 'refund AND escalation')""",
+    ),
+    (
+        "any column",
+        """SELECT "TaskID", "Assignee" FROM Tasks WHERE "Task Description" LIKE '%outage%' OR "Notes" LIKE '%outage%'""",
+        """SELECT "TaskID", "Assignee" FROM Tasks WHERE rowid IN (SELECT rowid FROM Tasks_fts WHERE Tasks_fts MATCH 'outage')""",
+    ),
+    (
+        "name",
+        """SELECT COUNT(*) FROM Tasks WHERE "Notes" LIKE '% vendor17'""",
+        """SELECT COUNT(*) FROM Tasks WHERE rowid IN (SELECT rowid FROM Tasks_fts WHERE "Notes" MATCH 'vendor17')""",
+    ),
+]
+
+def make_sheet(n):
+    rng = random.Random(42)
+
+    def text(words):
+        chosen = [rng.choice(COMMON_WORDS) for _ in range(words)]
+        chosen[rng.randrange(words)] = rng.choice(TOPIC_WORDS)
+        if rng.random() < 0.02:
+            chosen.append(rng.choice(TOPIC_WORDS))
+        return " ".join(chosen).capitalize()
+
+    return [{
+        "TaskID": i,
+        "Task Description": text(rng.randint(8, 16)),
+        "Notes": f"{text(rng.randint(4, 20))}, vendor{rng.randint(1, 2000)}",
+        "Assignee": f"user{rng.randint(1, 200)}",
+        "Status": rng.choice(["Pending", "Completed", "In Progress"]),
+    } for i in range(1, n + 1)]
+
+def sync(rows, enabled):
+    script.FULLTEXT_INDEX = enabled
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        script.write_to_sqlite({"Tasks": rows}, "sheets.db")
+    return time.perf_counter() - start
+
+def best_time(conn, sql, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = conn.execute(sql).fetchall()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    script.INDEX_ADVISOR = False
+    rows = make_sheet(args.rows)
+
+    timings = {}
+    for enabled in (False, True):
+        if os.path.exists("sheets.db"):
+            os.remove("sheets.db")
+        script._row_hashes.clear()
+        full = sync(rows, enabled)
+        rows[0]["Task Description"] += " (edited)"
+        timings[enabled] = (full, sync(rows, enabled))
+
+    print(f"{args.rows:,}-row text-heavy sheet")
+    for enabled, label in ((False, "without"), (True, "with")):
+        full, edit = timings[enabled]
+        print(f"sync {label:>7} the full-text index: first {full:.2f}s, one-cell edit {edit * 1000:.0f} ms")
+
+    conn = sqlite3.connect("file:sheets.db?mode=ro", uri=True)
+    for name, like, match in SEARCHES:
+        like_time, like_result = best_time(conn, like)
+        match_time, match_result = best_time(conn, match)
+        counts = f"{like_result[0][0]:,} vs {match_result[0][0]:,}" if "COUNT" in like else f"{len(like_result):,} vs {len(match_result):,}"
+        print(f"{name:>10}: LIKE {like_time * 1000:8.2f} ms, MATCH {match_time * 1000:7.2f} ms  "
+              f"{like_time / match_time:6.1f}x  (rows {counts})")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
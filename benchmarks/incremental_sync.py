@@ -0,0 +1,76 @@
+"""
+Write volume of small sheet edits: full rebuild versus incremental sync.
+
+Builds a synthetic sheet, writes it once to two databases, then applies a
+one-cell edit, a row inserted at the top and a row deleted from the middle,
+syncing after each with SYNC_MODE=full (drop + reinsert everything) on one
+and with the incremental row diff on the other.
+
+    python benchmarks/incremental_sync.py --rows 100000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import script
+
+
+def make_sheet(n):
+    rng = random.Random(42)
+    statuses = ["Pending", "Completed", "Done", "In Progress"]
+    priorities = ["High", "Low", "Urgent", "H", "L"]
+    return [{
+        "TaskID": i,
+        "Task Description": f"Follow up on invoice {rng.randint(1000, 9999)} with vendor {rng.randint(1, 500)}",
+        "Assignee": f"user{rng.randint(1, 50)}",
+        "Status": rng.choice(statuses),
+        "Priority": rng.choice(priorities),
+        "Hours": round(rng.uniform(0.5, 40), 1),
+    } for i in range(1, n + 1)]
+
+def rows_written(stats):
+    return sum(t["inserted"] + t["updated"] + t["deleted"] for t in stats.values())
+
+def sync(rows, db_name, mode):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        script.write_to_sqlite({"Tasks": rows}, db_name, mode=mode)
+    return time.perf_counter() - start, rows_written(script.last_write_stats)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = make_sheet(args.rows)
+    directory = tempfile.mkdtemp()
+    databases = {mode: os.path.join(directory, f"{mode}.db") for mode in ("full", "incremental")}
+    for mode, db_name in databases.items():
+        sync(rows, db_name, mode)
+
+    def edit_cell():
+        rows[args.rows // 2]["Status"] = "Completed (edited)"
+
+    def insert_top():
+        rows.insert(0, {**rows[0], "TaskID": 0, "Task Description": "Newly added task"})
+
+    def delete_middle():
+        del rows[args.rows // 3]
+
+    print(f"{args.rows:,}-row sheet")
+    for label, edit in (("one-cell edit", edit_cell), ("row inserted at top", insert_top), ("row deleted in middle", delete_middle)):
+        edit()
+        for mode, db_name in databases.items():
+            elapsed, written = sync(rows, db_name, mode)
+            print(f"{label:<22} {mode:<12}: {written:>9,} rows written in {elapsed:6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Query latency of a recorded workload before and after the index advisor runs.
+
+Syncs a synthetic task sheet with the advisor off, times a workload of the
+filters the SQL generator typically writes, records that workload the way
+the agent does, and syncs again so the advisor creates indexes and runs
+ANALYZE. Then times the same queries again.
+
+    python benchmarks/index_advisor.py --rows 200000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import script
+
+WORKLOAD = [
+    """SELECT COUNT(*) FROM Tasks WHERE "Assignee" = 'user7'""",
+    """SELECT "TaskID", "Task Description" FROM Tasks WHERE "Assignee" = 'user12' AND "Status" = 'Pending'""",
+    """SELECT * FROM Tasks WHERE "Status" IN ('Done', 'Completed') AND "Assignee" = 'user3' ORDER BY "Due Date" DESC LIMIT 10""",
+    """SELECT COUNT(*) FROM Tasks WHERE "Due Date" BETWEEN '2024-03-01' AND '2024-03-07'""",
+    """SELECT "Assignee", SUM("Hours") FROM Tasks WHERE "Priority" = 'Urgent' GROUP BY "Assignee\"""",
+]
+
+def make_sheet(n):
+    rng = random.Random(42)
+    return [{
+        "TaskID": i,
+        "Task Description": f"Follow up on invoice {rng.randint(1000, 9999)} with vendor {rng.randint(1, 500)}",
+        "Assignee": f"user{rng.randint(1, 200)}",
+        "Status": rng.choice(["Pending", "Completed", "Done", "In Progress"]),
+        "Priority": rng.choice(["High", "Low", "Urgent", "Medium", "Later"]),
+        "Due Date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "Hours": round(rng.uniform(0.5, 40), 1),
+    } for i in range(1, n + 1)]
+
+def time_workload(db_name, repeat=5):
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    timings = []
+    for sql in WORKLOAD:
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql).fetchall()
+            best = min(best, time.perf_counter() - start)
+        timings.append(best)
+    conn.close()
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    rows = make_sheet(args.rows)
+    with contextlib.redirect_stdout(io.StringIO()):
+        script.INDEX_ADVISOR = False
+        script.write_to_sqlite({"Tasks": rows}, "sheets.db")
+    before = time_workload("sheets.db")
+
+    for sql in WORKLOAD:
+        for _ in range(3):
+            script.index_advisor.record(sql)
+    rows[0]["Status"] = "Done (edited)"
+    with contextlib.redirect_stdout(io.StringIO()):
+        script.INDEX_ADVISOR = True
+        script.write_to_sqlite({"Tasks": rows}, "sheets.db")
+    report = script.index_advisor.last_report
+    after = time_workload("sheets.db")
+
+    print(f"{args.rows:,}-row sheet; advisor created {len(report['created'])} indexes in {report['seconds']:.2f}s:")
+    for index in report["created"]:
+        print(f"  {index}")
+    for sql, old, new in zip(WORKLOAD, before, after):
+        print(f"{old * 1000:8.2f} ms -> {new * 1000:7.2f} ms  {old / new:6.1f}x  {sql[:70]}")
+    print(f"{sum(before) * 1000:8.2f} ms -> {sum(after) * 1000:7.2f} ms  total")
+
+
+if __name__ == "__main__":
+    main()
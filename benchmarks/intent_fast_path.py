@@ -0,0 +1,97 @@
+"""
+Intent classification latency with and without the local fast path.
+
+Classifies a mix of chat messages (greetings, thanks, data questions and a
+few ambiguous ones) once with every message going to the LLM classifier and
+once with the local classifier in front of it, against a local fake LLM.
+Reports the fraction of messages that skipped the LLM call, the p50
+classification latency of each run, and how often the local decision agreed
+with the expected label.
+
+    python benchmarks/intent_fast_path.py --latency 0.4
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm import use_fake_llm
+
+MESSAGES = [
+    ("Conversation", "hi"),
+    ("Conversation", "hello there"),
+    ("Conversation", "thanks!"),
+    ("Conversation", "thank you so much"),
+    ("Conversation", "ok"),
+    ("Conversation", "good morning"),
+    ("Conversation", "bye"),
+    ("Conversation", "Aaj kya date?"),
+    ("Conversation", "what can you do?"),
+    ("Conversation", "write me a short poem"),
+    ("DatabaseQuery", "how many tasks are pending?"),
+    ("DatabaseQuery", "show all tasks assigned to ravi"),
+    ("DatabaseQuery", "which assignee has the most urgent tasks"),
+    ("DatabaseQuery", "average hours for completed tasks"),
+    ("DatabaseQuery", "count of rows in the archive"),
+    ("DatabaseQuery", "list high priority tasks"),
+    ("DatabaseQuery", "total hours by assignee"),
+    ("DatabaseQuery", "what is the status of task 17"),
+    ("DatabaseQuery", "who is ravi"),
+    ("DatabaseQuery", "give me a summary of tasks"),
+]
+
+async def classify_all(agent, fast_path):
+    from intent import IntentClassifier
+
+    agent.INTENT_FAST_PATH = fast_path
+    # A fresh model, so the run does not learn from the fake LLM's labels.
+    agent.intent_classifier = IntentClassifier()
+    latencies, local = [], 0
+    agreed = decided = 0
+    for expected, question in MESSAGES:
+        before = agent.intent_classifier.stats()["decisions"].get("llm", 0)
+        start = time.perf_counter()
+        update = await agent.aclassify_intent_node({"question": question, "chat_history": []})
+        latencies.append(time.perf_counter() - start)
+        if fast_path and agent.intent_classifier.stats()["decisions"].get("llm", 0) == before:
+            local += 1
+            decided += 1
+            agreed += update["intent"] == expected
+    return latencies, local, agreed, decided
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.4, help="seconds per fake LLM call")
+    args = parser.parse_args()
+
+    use_fake_llm(latency=args.latency)
+    os.chdir(tempfile.mkdtemp())
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import script
+        script.write_to_sqlite({
+            "Tasks": [{"TaskID": 1, "Task Description": "Call vendor", "Assignee": "ravi",
+                       "Status": "Pending", "Priority": "High", "Hours": 2.5}],
+            "Archive": [{"TaskID": 0, "Notes": "migrated"}],
+        }, "sheets.db")
+        import agent
+
+        llm_only, _, _, _ = asyncio.run(classify_all(agent, fast_path=False))
+        fast, local, agreed, decided = asyncio.run(classify_all(agent, fast_path=True))
+
+    print(f"{len(MESSAGES)} messages, {args.latency:.2f}s per LLM call")
+    print(f"skipped the LLM call   : {local}/{len(MESSAGES)} ({local / len(MESSAGES):.0%})")
+    print(f"local decisions correct: {agreed}/{decided}")
+    print(f"p50 LLM only           : {statistics.median(llm_only) * 1000:8.1f} ms")
+    print(f"p50 with fast path     : {statistics.median(fast) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
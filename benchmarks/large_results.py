@@ -0,0 +1,78 @@
+"""
+Summarizer prompt size for a large result: raw rows versus the shaped digest.
+
+Runs `SELECT *` over a synthetic task sheet through the same guarded
+executor the agent uses and compares the raw `SQLDatabase.run`-style text
+with the digest that `result_shaping` sends to the summarizer instead.
+
+    python benchmarks/large_results.py --rows 20000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_shaping import shape_result
+from sql_guard import format_rows, run_limited
+
+
+class MemoryEngine:
+    """Just enough of a SQLAlchemy engine for `run_limited`."""
+
+    class Connection:
+        def __init__(self, connection):
+            self.driver_connection = connection
+
+        def cursor(self):
+            return self.driver_connection.cursor()
+
+        def close(self):
+            pass
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def raw_connection(self):
+        return self.Connection(self.connection)
+
+def make_table(n):
+    rng = random.Random(42)
+    connection = sqlite3.connect(":memory:")
+    connection.execute('CREATE TABLE Tasks (TaskID INTEGER, "Task Description" TEXT, Assignee TEXT, Status TEXT, Priority TEXT, Hours REAL)')
+    connection.executemany("INSERT INTO Tasks VALUES (?, ?, ?, ?, ?, ?)", [(
+        i,
+        f"Follow up on invoice {rng.randint(1000, 9999)} with vendor {rng.randint(1, 500)}",
+        f"user{rng.randint(1, 50)}",
+        rng.choice(["Pending", "Completed", "Done", "In Progress"]),
+        rng.choice(["High", "Low", "Urgent"]),
+        round(rng.uniform(0.5, 40), 1),
+    ) for i in range(1, n + 1)])
+    return connection
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    args = parser.parse_args()
+
+    engine = MemoryEngine(make_table(args.rows))
+    columns, rows, error, _ = run_limited("SELECT * FROM Tasks", engine, 30, 10**7, 10**10)
+    if error:
+        raise SystemExit(error)
+
+    raw = format_rows(rows)
+    start = time.perf_counter()
+    shaped, _ = shape_result(columns, rows, 50, 6000)
+    elapsed = time.perf_counter() - start
+
+    # ~4 characters per token for English text and numbers
+    print(f"SELECT * over {args.rows:,} rows")
+    print(f"raw result : {len(raw):>12,} chars (~{len(raw) // 4:,} tokens)")
+    print(f"digest     : {len(shaped):>12,} chars (~{len(shaped) // 4:,} tokens), built in {elapsed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
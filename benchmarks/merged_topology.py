@@ -0,0 +1,63 @@
+"""
+Latency of a database question with the split and the merged graph topology.
+
+The split graph makes two serial LLM calls before any SQL runs (classify the
+intent, then generate the query); the merged graph makes one structured-output
+call that returns the query directly. Runs the same questions through both
+against a local fake LLM, with the local intent fast path and direct answers
+turned off so every question takes the LLM route.
+
+    python benchmarks/merged_topology.py --questions 10 --latency 0.4
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm import use_fake_llm
+
+
+async def run(agent, graph, questions):
+    latencies = []
+    for question in questions:
+        # A cached query would skip both topologies' LLM calls.
+        agent.query_cache.entries.clear()
+        start = time.perf_counter()
+        await graph.ainvoke({"question": question, "chat_history": []})
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.4, help="seconds per fake LLM call")
+    args = parser.parse_args()
+
+    use_fake_llm(latency=args.latency)
+    os.chdir(tempfile.mkdtemp())
+
+    questions = [f"how many tasks does user{i} have?" for i in range(args.questions)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        import script
+        script.write_to_sqlite({"Tasks": [{"TaskID": 1, "Assignee": "user1", "Status": "Pending"}]}, "sheets.db")
+        import agent
+
+        agent.INTENT_FAST_PATH = False
+        agent.direct_answers.shapes = set()
+        split = asyncio.run(run(agent, agent.build_graph("split"), questions))
+        merged = asyncio.run(run(agent, agent.build_graph("merged"), questions))
+
+    print(f"{args.questions} database questions, {args.latency:.2f}s per LLM call")
+    print(f"split  (classify, generate, summarize): p50 {statistics.median(split):6.2f}s")
+    print(f"merged (route, summarize)             : p50 {statistics.median(merged):6.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Per-request cost of building the agent's prompts and runnables.
+
+The nodes used to build their prompt templates, `llm.bind_tools(...)` and,
+for conversation, a fresh `AgentExecutor` on every call; they now reuse the
+ones built at import. Times those builders, which is the construction work
+each request no longer does. No LLM calls are made.
+
+    python benchmarks/runnable_construction.py --iterations 2000
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.chdir(tempfile.mkdtemp())
+    with contextlib.redirect_stdout(io.StringIO()):
+        import agent
+
+    builders = {
+        "classify intent (prompt + bind_tools)": agent._build_classify_intent_runnable,
+        "conversation AgentExecutor": agent._build_conversation_executor,
+        "generate query prompt": lambda: agent._build_generate_query_runnable(fix_error=False),
+        "summarize prompt": agent._build_summarize_result_runnable,
+    }
+
+    costs = {}
+    for name, build in builders.items():
+        costs[name] = timeit.timeit(build, number=args.iterations) / args.iterations
+        print(f"{name:<40} {costs[name] * 1e6:9.1f} us")
+
+    database = sum(costs[n] for n in ("classify intent (prompt + bind_tools)", "generate query prompt", "summarize prompt"))
+    conversation = costs["classify intent (prompt + bind_tools)"] + costs["conversation AgentExecutor"]
+    print(f"saved per database question            {database * 1e6:9.1f} us")
+    print(f"saved per conversational message       {conversation * 1e6:9.1f} us")
+
+
+if __name__ == "__main__":
+    main()
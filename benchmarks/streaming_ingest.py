@@ -0,0 +1,112 @@
+"""
+Peak memory of a sync: `response.json()` ingest versus the streaming path.
+
+Serves a synthetic Apps Script payload of the requested size from a local
+HTTP stand-in (generated on the fly, so the server itself stays small) and
+syncs it into a fresh database once per ingest mode, each in its own process.
+Reports the peak resident memory of each process.
+
+    python benchmarks/streaming_ingest.py --mb 500
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def payload_chunks(target_bytes, sheets=("Tasks", "Archive")):
+    """Yields a `{"Sheet": [rows...], ...}` document of roughly `target_bytes`."""
+    per_sheet = target_bytes // len(sheets)
+    yield b"{"
+    for s, sheet in enumerate(sheets):
+        yield (", " if s else "").encode() + json.dumps(sheet).encode() + b": ["
+        written, i = 0, 0
+        buffer = []
+        while written < per_sheet:
+            i += 1
+            row = json.dumps({
+                "TaskID": i,
+                "Task Description": f"Follow up on invoice {i % 9973} with the vendor and confirm the delivery schedule",
+                "Assignee": f"user{i % 50}",
+                "Status": ("Pending", "Completed", "Done")[i % 3],
+                "Priority": ("High", "Low", "Urgent")[i % 3],
+                "Hours": round((i % 400) / 10, 1),
+            }).encode()
+            buffer.append((b", " if i > 1 else b"") + row)
+            written += len(row) + 2
+            if len(buffer) == 1000:
+                yield b"".join(buffer)
+                buffer = []
+        yield b"".join(buffer) + b"]"
+    yield b"}"
+
+def serve(target_bytes):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.0"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.end_headers()
+            for chunk in payload_chunks(target_bytes):
+                self.wfile.write(chunk)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/exec"
+
+def worker(mode, url, db_name):
+    import script
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "stream":
+            script.write_stream_to_sqlite(script.stream_data_from_sheet(url), db_name)
+        else:
+            script.write_to_sqlite(script.fetch_data_from_sheet(url), db_name)
+    elapsed = time.perf_counter() - start
+    rows = sum(t["inserted"] for t in script.last_write_stats.values())
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"rows": rows, "seconds": elapsed, "peak_mb": peak_mb}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=int, default=500, help="payload size in megabytes")
+    parser.add_argument("--modes", default="json,stream")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args.worker, args.url, args.db)
+
+    url = serve(args.mb * 1024 * 1024)
+    print(f"{args.mb} MB payload")
+    for mode in args.modes.split(","):
+        db_name = os.path.join(tempfile.mkdtemp(), "bench.db")
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", mode, "--url", url, "--db", db_name],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>6}: {result['rows']:>10,} rows in {result['seconds']:7.1f}s, peak RSS {result['peak_mb']:8.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Micro-benchmarks for column type inference.
+
+Compares the original column-by-column `infer_column_types` with the current
+single-pass implementation on a few sheet shapes, and checks that they agree.
+
+    python benchmarks/type_inference.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import script
+
+
+def legacy_infer_column_types(rows):
+    """The implementation this module replaced, kept verbatim as the baseline."""
+    if not rows:
+        return {}
+
+    column_types = {}
+    columns = [col for col in rows[0].keys() if col]
+
+    for col in columns:
+        is_integer = True
+        is_real = True
+
+        for row in rows:
+            value = str(row.get(col, ''))
+            if value is None or value == '':
+                continue
+
+            if is_integer and not (value.isdigit() or (value.startswith('-') and value[1:].isdigit())):
+                is_integer = False
+
+            if is_real and not is_integer:
+                try:
+                    float(value)
+                except ValueError:
+                    is_real = False
+
+            if not is_integer and not is_real:
+                break
+
+        if is_integer:
+            column_types[col] = "INTEGER"
+        elif is_real:
+            column_types[col] = "REAL"
+        else:
+            column_types[col] = "TEXT"
+
+    return column_types
+
+def make_cell(kind, rng, i):
+    if kind == "int":
+        return rng.randint(-1000, 100000)
+    if kind == "intstr":
+        return str(rng.randint(0, 100000)) if rng.random() > 0.05 else ""
+    if kind == "real":
+        return round(rng.uniform(0, 1000), 2)
+    if kind == "realstr":
+        return f"{rng.uniform(0, 1000):.3f}"
+    if kind == "late_text":
+        # numeric until the very last row, the worst case for early exit
+        return "n/a" if i == -1 else str(rng.randint(0, 100))
+    return rng.choice(["Pending", "Completed", "Done", "High", "Low"])
+
+def make_rows(n_rows, kinds, seed=7):
+    rng = random.Random(seed)
+    rows = [{f"c{j}_{kind}": make_cell(kind, rng, i) for j, kind in enumerate(kinds)} for i in range(n_rows)]
+    for col in rows[-1]:
+        if col.endswith("late_text"):
+            rows[-1][col] = "n/a"
+    return rows
+
+SCENARIOS = {
+    "narrow numeric (100k x 8)": (100_000, ["int", "intstr", "real", "realstr", "text", "int", "late_text", "text"]),
+    "text heavy (100k x 8)": (100_000, ["text"] * 6 + ["int", "intstr"]),
+    "wide (10k x 200)": (10_000, ["int", "intstr", "real", "realstr", "text", "late_text", "int", "real"] * 25),
+}
+
+def best_of(func, rows, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(rows)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    variants = [("legacy", legacy_infer_column_types), ("single pass", script.infer_column_types)]
+
+    for name, (n_rows, kinds) in SCENARIOS.items():
+        rows = make_rows(n_rows, kinds)
+        print(name)
+        baseline_time, expected = best_of(legacy_infer_column_types, rows)
+        for label, func in variants:
+            elapsed, result = best_of(func, rows)
+            status = "ok" if result == expected else "MISMATCH"
+            print(f"  {label:<20} {elapsed * 1000:9.1f} ms  {baseline_time / elapsed:5.1f}x  {status}")
+
+
+if __name__ == "__main__":
+    main()
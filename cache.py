@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A thread-safe mapping bounded to `maxsize` entries that evicts the least
+    recently used one. `on_evict`, if given, is called with each value that
+    is evicted or cleared, after the lock is released.
+    """
+
+    def __init__(self, maxsize=256, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value and marks it as recently used, counting a hit or a miss."""
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def touch(self, key):
+        """Marks an entry as recently used without counting a lookup."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+
+    def put(self, key, value):
+        evicted = []
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[1])
+                self.evictions += 1
+        self._evicted(evicted)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, None)
+
+    def items(self):
+        """A snapshot of the entries, most recently used last."""
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._data.values())
+            self._data.clear()
+        self._evicted(evicted)
+
+    def _evicted(self, values):
+        if self.on_evict is not None:
+            for value in values:
+                self.on_evict(value)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
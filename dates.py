@@ -0,0 +1,203 @@
+"""
+Date and datetime columns.
+
+The Apps Script payload carries dates either as JSON timestamps
+("2024-03-01T18:30:00.000Z", how `JSON.stringify` writes a sheet's Date
+cells) or as whatever text was typed ("01/03/2024", "1 Mar 2024"). A TEXT
+column whose every value parses as one of those is declared DATE (when no
+value has a time of day) or DATETIME, and is stored as ISO-8601 text,
+'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'. Those strings sort chronologically,
+work with SQLite's date functions, and turn range filters into index seeks.
+
+Timestamps with a UTC offset are converted to the spreadsheet's timezone
+first, so a date entered as 2 March in India is not stored as 1 March. The
+timezone comes from the payload (see `set_timezone`) or SHEET_TIMEZONE; with
+neither, such timestamps are not treated as dates and their columns stay
+TEXT, rather than being read in a guessed timezone. Numeric dates are read
+day first unless SHEET_DATE_ORDER=MDY.
+"""
+import hashlib
+import os
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+DATE, DATETIME = "DATE", "DATETIME"
+DATE_TYPES = (DATE, DATETIME)
+
+SHEET_TIMEZONE = ZoneInfo(os.environ["SHEET_TIMEZONE"]) if os.getenv("SHEET_TIMEZONE") else None
+DAY_FIRST = os.getenv("SHEET_DATE_ORDER", "DMY").upper() != "MDY"
+
+MONTHS = {name: i for i, names in enumerate([
+    ("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",), ("jun", "june"),
+    ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"), ("oct", "october"), ("nov", "november"),
+    ("dec", "december"),
+], start=1) for name in names}
+
+_TIME = r"(?:[ T,]+(\d{1,2}):(\d{2})(?::(\d{2}))?\s*([AaPp][Mm])?)?"
+# 01/03/2024, 1-3-2024, 01.03.2024
+_NUMERIC = re.compile(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})" + _TIME)
+# 2024/03/01
+_YEAR_FIRST = re.compile(r"(\d{4})/(\d{1,2})/(\d{1,2})" + _TIME)
+# 1 Mar 2024, 01-Mar-2024
+_DAY_MONTH = re.compile(r"(\d{1,2})[ -]([A-Za-z]{3,9})\.?[ ,-]+(\d{4})" + _TIME)
+# Mar 1, 2024
+_MONTH_DAY = re.compile(r"([A-Za-z]{3,9})\.? (\d{1,2})(?:st|nd|rd|th)?,? (\d{4})" + _TIME)
+
+
+# The timezone timestamps are read in: the payload's, else SHEET_TIMEZONE.
+_timezone = SHEET_TIMEZONE
+_warned_no_timezone = False
+
+def set_timezone(name):
+    """
+    Reads timestamps in the IANA timezone `name`, the spreadsheet's own as
+    the payload reports it; None goes back to SHEET_TIMEZONE. Returns True
+    when that changes the timezone. Raises zoneinfo.ZoneInfoNotFoundError
+    (or ValueError) for an unknown name.
+    """
+    global _timezone
+    zone = ZoneInfo(name) if name else SHEET_TIMEZONE
+    if zone == _timezone:
+        return False
+    _timezone = zone
+    _parse_text.cache_clear()
+    return True
+
+def today():
+    """Today's date in the sheet's timezone (the server's own when none is known)."""
+    return datetime.now(_timezone).date() if _timezone else date.today()
+
+def _with_time(year, month, day, hour, minute, second, meridiem):
+    hour, minute, second = int(hour or 0), int(minute or 0), int(second or 0)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.lower() == "pm" else 0)
+    return datetime(int(year), int(month), int(day), hour, minute, second)
+
+def parse(value):
+    """The datetime a sheet cell means, or None when it is not a date."""
+    if not isinstance(value, str):
+        return None
+    return _parse_text(value.strip())
+
+# Date columns repeat the same few hundred values, so most cells are cache hits.
+@lru_cache(maxsize=4096)
+def _parse_text(value):
+    try:
+        if len(value) >= 10 and value[4] == "-" and value[7] == "-":
+            parsed = datetime.fromisoformat(value)
+            if parsed.tzinfo is not None:
+                if _timezone is None:
+                    _warn_no_timezone()
+                    return None
+                parsed = parsed.astimezone(_timezone).replace(tzinfo=None)
+            return parsed.replace(microsecond=0)
+
+        match = _NUMERIC.fullmatch(value)
+        if match:
+            first, second, year, *time = match.groups()
+            day, month = (first, second) if DAY_FIRST else (second, first)
+            return _with_time(year, month, day, *time)
+        match = _YEAR_FIRST.fullmatch(value)
+        if match:
+            return _with_time(*match.groups())
+        match = _DAY_MONTH.fullmatch(value)
+        if match and match.group(2).lower() in MONTHS:
+            day, month, year, *time = match.groups()
+            return _with_time(year, MONTHS[month.lower()], day, *time)
+        match = _MONTH_DAY.fullmatch(value)
+        if match and match.group(1).lower() in MONTHS:
+            month, day, year, *time = match.groups()
+            return _with_time(year, MONTHS[month.lower()], day, *time)
+    except ValueError: # e.g. 31/02/2024
+        return None
+    return None
+
+def _warn_no_timezone():
+    global _warned_no_timezone
+    if not _warned_no_timezone:
+        _warned_no_timezone = True
+        print("⚠️ Timestamp cells left as text: the sheet's timezone is unknown. "
+              "Send it in the payload (see the README) or set SHEET_TIMEZONE.")
+
+def detect(values):
+    """DATE or DATETIME when every non-empty value is a date, else None."""
+    kind = None
+    for value in values:
+        if value is None or value == "":
+            continue
+        parsed = parse(value)
+        if parsed is None:
+            return None
+        if kind != DATETIME:
+            kind = DATE if (parsed.hour, parsed.minute, parsed.second) == (0, 0, 0) else DATETIME
+    return kind
+
+def to_iso(value, kind):
+    """The ISO-8601 text stored for `value` in a column of `kind`; empty cells become NULL."""
+    if value is None or value == "":
+        return None
+    parsed = parse(value)
+    if parsed is None:
+        return value
+    if kind == DATE:
+        return parsed.date().isoformat()
+    return parsed.isoformat(sep=" ")
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def index_name(table, column):
+    digest = hashlib.sha1(f"{table}\0{column}".encode()).hexdigest()[:12]
+    return f"date_{re.sub(r'[^0-9a-zA-Z]+', '_', table)[:30]}_{digest}"
+
+def date_columns(cursor, table):
+    """`(column, DATE or DATETIME)` for the date columns of `table`."""
+    return [(name, col_type) for _, name, col_type, *_ in cursor.execute(f"PRAGMA table_info({_quote(table)})")
+            if col_type in DATE_TYPES]
+
+def ensure_indexes(cursor, table):
+    """Indexes every date column of `table`; a no-op for the ones that already are."""
+    for column, _ in date_columns(cursor, table):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {_quote(index_name(table, column))} ON {_quote(table)} ({_quote(column)})")
+
+def describe(cursor, tables):
+    """
+    The schema prompt section about the date columns and the range they
+    cover, or "" when there are none. It states today's date in the sheet's
+    timezone, since SQLite's date('now') is UTC and the stored dates are not;
+    it must be rebuilt when `today()` changes.
+    """
+    lines, example = [], None
+    for table in tables:
+        for column, kind in date_columns(cursor, table):
+            # A DATETIME column makes the better example: BETWEEN would drop its last day.
+            if example is None or (kind == DATETIME and example[1] == DATE):
+                example = (_quote(column), kind)
+            # Both ends come straight from the column's index.
+            first = cursor.execute(f"SELECT MIN({_quote(column)}) FROM {_quote(table)}").fetchone()[0]
+            last = cursor.execute(f"SELECT MAX({_quote(column)}) FROM {_quote(table)}").fetchone()[0]
+            form = "'YYYY-MM-DD'" if kind == DATE else "'YYYY-MM-DD HH:MM:SS'"
+            span = f", from {first} to {last}" if first is not None else ""
+            lines.append(f"- {_quote(table)}.{_quote(column)} is a {kind} column (indexed), stored as {form} text{span}.")
+    if not lines:
+        return ""
+    example, now = example[0], today()
+    monday = now - timedelta(days=now.weekday())
+    return "\n".join([
+        "",
+        "--- Dates ---",
+        *lines,
+        f"- Today is {now.isoformat()} ({now:%A}) in the sheet's timezone. Do not use date('now'), which is UTC "
+        "and can be a day off; write date literals relative to today instead.",
+        "- Compare these columns directly with literals, as half-open ranges so a DATETIME column keeps the "
+        f"whole last day: e.g. {example} >= '{monday.isoformat()}' AND {example} < "
+        f"'{(monday + timedelta(days=7)).isoformat()}' for this week, {example} >= '{now.isoformat()}' AND "
+        f"{example} < '{(now + timedelta(days=1)).isoformat()}' for today, or {example} >= "
+        f"'{(now - timedelta(days=30)).isoformat()}' for the last 30 days. Do not wrap the column in substr(), "
+        "strftime() or date(), which stops the index from being used.",
+        "------------------------",
+    ])
@@ -0,0 +1,139 @@
+"""
+FTS5 shadow tables for the long text columns of each sheet.
+
+`LIKE '%invoice%'` cannot use an index, so every such question scans the
+whole table. During sync, `sync_fulltext` keeps an external-content FTS5
+table named `<table>_fts` over the TEXT columns whose values are long
+(descriptions, notes, comments). Triggers on the base table keep it current
+through the incremental row updates; it is rebuilt only when the table is
+recreated or the set of long columns changes. `describe` renders the
+section of the schema prompt that tells the SQL generator to use MATCH.
+"""
+
+FTS_SUFFIX = "_fts"
+# Tables FTS5 creates alongside `<table>_fts` to hold the index itself.
+SHADOW_SUFFIXES = ("_data", "_idx", "_content", "_docsize", "_config")
+# Porter stemming, so "invoices" also matches "invoice".
+TOKENIZER = "porter unicode61 remove_diacritics 2"
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def fts_name(table):
+    return table + FTS_SUFFIX
+
+def _triggers(table):
+    return [f"{table}{FTS_SUFFIX}_{kind}" for kind in ("insert", "delete", "update")]
+
+def long_text_columns(cursor, table, min_average_chars, sample_rows):
+    """TEXT columns whose non-empty values average at least `min_average_chars` characters."""
+    text_columns = [name for _, name, col_type, *_ in cursor.execute(f"PRAGMA table_info({_quote(table)})") if col_type == "TEXT"]
+    if not text_columns:
+        return []
+    averages = ", ".join(f"AVG(NULLIF(LENGTH({_quote(c)}), 0))" for c in text_columns)
+    sample = f"SELECT * FROM {_quote(table)} LIMIT {int(sample_rows)}"
+    row = cursor.execute(f"SELECT {averages} FROM ({sample})").fetchone()
+    return [c for c, average in zip(text_columns, row) if average is not None and average >= min_average_chars]
+
+def indexed_columns(cursor, table):
+    """The columns of `table`'s FTS table, or None when it has none."""
+    exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_name(table),)
+    ).fetchone()
+    if not exists:
+        return None
+    return [name for _, name, *_ in cursor.execute(f"PRAGMA table_info({_quote(fts_name(table))})")]
+
+def drop(cursor, table):
+    for trigger in _triggers(table):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {_quote(trigger)}")
+    cursor.execute(f"DROP TABLE IF EXISTS {_quote(fts_name(table))}")
+
+def _create(cursor, table, columns):
+    fts, quoted_fts = fts_name(table), _quote(fts_name(table))
+    quoted_columns = ", ".join(_quote(c) for c in columns)
+    new_values = ", ".join(f"new.{_quote(c)}" for c in columns)
+    old_values = ", ".join(f"old.{_quote(c)}" for c in columns)
+    insert, delete, update = (_quote(t) for t in _triggers(table))
+    # An external-content table must be told the old values of a row to remove it.
+    remove_old = f"INSERT INTO {quoted_fts} ({quoted_fts}, rowid, {quoted_columns}) VALUES ('delete', old.rowid, {old_values});"
+    add_new = f"INSERT INTO {quoted_fts} (rowid, {quoted_columns}) VALUES (new.rowid, {new_values});"
+
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE {quoted_fts} USING fts5({quoted_columns}, "
+        f"content={_quote(table)}, content_rowid='rowid', tokenize='{TOKENIZER}')"
+    )
+    cursor.execute(f"CREATE TRIGGER {insert} AFTER INSERT ON {_quote(table)} BEGIN {add_new} END")
+    cursor.execute(f"CREATE TRIGGER {delete} AFTER DELETE ON {_quote(table)} BEGIN {remove_old} END")
+    cursor.execute(f"CREATE TRIGGER {update} AFTER UPDATE ON {_quote(table)} BEGIN {remove_old} {add_new} END")
+    cursor.execute(f"INSERT INTO {quoted_fts} ({quoted_fts}) VALUES ('rebuild')")
+    print(f"Full-text index '{fts}' built over {columns}.")
+
+def sync_fulltext(cursor, table, rebuilt, changed, min_average_chars=32, sample_rows=20000):
+    """
+    Brings `table`'s FTS table in line with its current long text columns,
+    on the sync's open transaction. `rebuilt` means the table was recreated
+    (which drops its triggers); `changed` means rows were written. Returns
+    "built", "dropped" or None when nothing had to be done.
+    """
+    current = indexed_columns(cursor, table)
+    if current is not None and not rebuilt and not changed:
+        return None
+
+    columns = long_text_columns(cursor, table, min_average_chars, sample_rows)
+    if columns == current and not rebuilt:
+        # The triggers already applied this sync's row changes.
+        return None
+    if not columns:
+        if current is None:
+            return None
+        drop(cursor, table)
+        print(f"Full-text index '{fts_name(table)}' dropped; no long text columns left.")
+        return "dropped"
+
+    drop(cursor, table)
+    _create(cursor, table, columns)
+    return "built"
+
+def fulltext_tables(cursor):
+    """`{table: (fts_table, columns)}` for every FTS table built by `sync_fulltext`."""
+    tables = {}
+    for (name,) in cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%fts5%'"
+    ).fetchall():
+        if name.endswith(FTS_SUFFIX):
+            columns = [column for _, column, *_ in cursor.execute(f"PRAGMA table_info({_quote(name)})")]
+            tables[name[:-len(FTS_SUFFIX)]] = (name, columns)
+    return tables
+
+def hidden_tables(cursor, fulltext):
+    """The FTS tables and those of their shadow tables that exist, which stay out of the regular schema prompt."""
+    names = set()
+    for fts, _ in fulltext.values():
+        names.add(fts)
+        names.update(fts + suffix for suffix in SHADOW_SUFFIXES)
+    existing = {name for (name,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return names & existing
+
+def describe(fulltext):
+    """The schema prompt section about the full-text tables, or "" when there are none."""
+    if not fulltext:
+        return ""
+    lines = ["", "--- Full-Text Search ---"]
+    for table, (fts, columns) in fulltext.items():
+        lines.append(
+            f'- {_quote(fts)} is a full-text index over {", ".join(_quote(c) for c in columns)} of {_quote(table)}; '
+            f"its rowid is the {_quote(table)} rowid."
+        )
+    table, (fts, columns) = next(iter(fulltext.items()))
+    lines += [
+        "- To find rows whose text mentions a word or phrase, use MATCH on the full-text index instead of LIKE '%...%', "
+        "which has to scan every row. Words are matched by their stem, so 'invoice' also finds 'invoices'; "
+        "append * for a prefix ('inv*'), and combine terms with AND, OR, NOT or a quoted \"phrase\". For example:",
+        f"  SELECT COUNT(*) FROM {_quote(table)} WHERE rowid IN "
+        f"(SELECT rowid FROM {_quote(fts)} WHERE {_quote(columns[0])} MATCH 'invoice')",
+        f"- MATCH on the index name itself ({_quote(fts)} MATCH '...') searches all of its columns.",
+        "------------------------",
+    ]
+    return "\n".join(lines)
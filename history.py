@@ -0,0 +1,173 @@
+"""
+Token-budgeted chat history for the agent's prompts.
+
+The frontend sends the whole conversation on every turn. `HistoryManager`
+gives each node only the most recent messages that fit its token budget, and
+stands in for the older ones with a rolling summary. Summaries are cached by
+a hash of the messages they cover and extended incrementally from the longest
+cached prefix; they are refreshed on a background thread, so a turn never
+waits for one. Checkpointed sessions keep their history bounded with `fold`,
+which moves the oldest messages into a stored summary in one step rather
+than dropping one message per turn, so the cached prefixes stay valid.
+"""
+import hashlib
+import threading
+from functools import lru_cache
+
+from langchain_core.messages import SystemMessage
+
+from cache import LRUCache
+
+try:
+    import tiktoken
+except ImportError: # without tiktoken, token counts are estimated from length
+    tiktoken = None
+
+# Per-message overhead of the chat format, in tokens.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class HistoryManager:
+    """
+    `window(chat_history, node, summary)` returns the messages to send to
+    `node`; `summary`, when given, covers the messages before `chat_history`.
+
+    `budgets` maps a node name to `(max_messages, max_tokens)`; nodes listed
+    in `summary_nodes` also get the rolling summary of the turns that fell out
+    of their window. `summarize(previous_summary, messages)` produces a new
+    summary and is only ever called in the background.
+    """
+
+    def __init__(self, budgets, summarize=None, summary_nodes=(), model="gpt-4o-mini", cache_size=256):
+        self.budgets = budgets
+        self.summarize = summarize
+        self.summary_nodes = set(summary_nodes)
+        self.summaries = LRUCache(cache_size)
+        self.summary_runs = 0
+        self.summary_failures = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(model)
+            except Exception as e: # unknown model, or the encoding could not be downloaded
+                print(f"⚠️ tiktoken unavailable ({e}); estimating token counts from length.")
+        self.count_tokens = lru_cache(maxsize=4096)(self._count_tokens)
+
+    def _count_tokens(self, text):
+        if self._encoding is None:
+            return len(text) // 4 + 1
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def message_tokens(self, message):
+        return self.count_tokens(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+
+    def window(self, chat_history, node, summary=None):
+        """The newest messages within `node`'s budget, after the summary of the rest when it has one."""
+        max_messages, max_tokens = self.budgets[node]
+        kept, used = 0, 0
+        for message in reversed(chat_history[-max_messages:] if max_messages else []):
+            cost = self.message_tokens(message)
+            if used + cost > max_tokens:
+                break
+            kept += 1
+            used += cost
+
+        recent = chat_history[len(chat_history) - kept:] if kept else []
+        older = chat_history[:len(chat_history) - kept]
+        if node not in self.summary_nodes or self.summarize is None:
+            return recent
+
+        if older:
+            summary = self._summary(older, summary)
+        if not summary:
+            return recent
+        return [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] + recent
+
+    def _covered(self, messages, base):
+        """`(n, summary)` for the longest prefix `messages[:n]` with a cached summary on top of `base`."""
+        keys = _prefix_keys(messages, base)
+        cached = dict(self.summaries.items())
+        covered = next((i + 1 for i in range(len(keys) - 1, -1, -1) if keys[i] in cached), 0)
+        # One lookup, so the cache's hit rate counts turns rather than prefixes.
+        best = self.summaries.get(keys[covered - 1] if covered else keys[-1])
+        return covered, (best if covered else base), keys
+
+    def _summary(self, older, base=None):
+        """
+        The cached summary covering the longest prefix of `older` (`base`, the
+        summary of what came before `older`, when none is cached), refreshing
+        it in the background.
+        """
+        covered, best, keys = self._covered(older, base)
+        if covered < len(older):
+            self._refresh(keys[-1], best, older[covered:])
+        return best
+
+    def fold(self, chat_history, summary, max_messages):
+        """
+        Bounds a session's history to `max_messages`. Returns `(summary,
+        chat_history)`, with the oldest messages folded into `summary`, the
+        stored summary of everything before `chat_history`. The fold ends
+        where the longest cached summary does, which is usually all but the
+        newest few messages, so it needs no LLM call and the next turns build
+        on that summary. Only when the cache falls short (e.g. after a
+        restart) are the oldest messages, down to half of `max_messages`,
+        summarized here, which blocks.
+        """
+        overflow = len(chat_history) - max_messages
+        if overflow <= 0:
+            return summary, chat_history
+        if self.summarize is None:
+            return summary, chat_history[overflow:]
+
+        covered, best, _ = self._covered(chat_history, summary)
+        if covered >= overflow:
+            return best, chat_history[covered:]
+        drop = len(chat_history) - max_messages // 2
+        try:
+            best = self.summarize(best, chat_history[covered:drop])
+            self.summary_runs += 1
+        except Exception as e:
+            self.summary_failures += 1
+            print(f"❌ History summary failed, {drop} messages dropped without one: {e}")
+        return best, chat_history[drop:]
+
+    def _refresh(self, key, previous, messages):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        threading.Thread(target=self._run_summary, args=(key, previous, messages), daemon=True).start()
+
+    def _run_summary(self, key, previous, messages):
+        try:
+            self.summaries.put(key, self.summarize(previous, messages))
+            self.summary_runs += 1
+        except Exception as e:
+            self.summary_failures += 1
+            print(f"❌ History summary failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self):
+        return {
+            "summaries": self.summaries.stats(),
+            "summary_runs": self.summary_runs,
+            "summary_failures": self.summary_failures,
+            "tokenizer": "tiktoken" if self._encoding is not None else "estimate",
+        }
+
+
+def _prefix_keys(messages, base=None):
+    """Chained hashes, so keys[i] identifies messages[:i + 1] following the summary `base`."""
+    keys = []
+    digest = hashlib.sha1()
+    if base:
+        digest.update(f"summary:{base}\n".encode())
+    for message in messages:
+        digest.update(f"{message.type}:{message.content}\n".encode())
+        keys.append(digest.copy().hexdigest())
+    return keys
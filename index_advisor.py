@@ -0,0 +1,259 @@
+"""
+Indexes for the filters the agent's SQL actually uses.
+
+The agent records every query that ran (`IndexAdvisor.record`, an in-memory
+counter, so the hot path never writes to disk). During each sync,
+`IndexAdvisor.apply` folds the counts into a small workload database, parses
+the filter, join and ORDER BY columns out of the recorded queries, checks
+with EXPLAIN QUERY PLAN which of them still scan a table, and creates the
+most useful indexes. It drops the ones it created earlier that the workload
+no longer needs, runs ANALYZE, and drops any new index the planner still
+ignores. Only indexes named `advisor_*` are touched.
+"""
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+INDEX_PREFIX = "advisor_"
+
+_QUOTED_STRING = re.compile(r"'(?:[^']|'')*'")
+_CLAUSE = re.compile(r"\b(SELECT|FROM|JOIN|ON|WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT|UNION|EXCEPT|INTERSECT)\b", re.IGNORECASE)
+_NOT_ALIAS = ("WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "CROSS", "NATURAL", "OUTER", "FULL", "ON", "USING",
+              "GROUP", "ORDER", "LIMIT", "HAVING", "UNION", "EXCEPT", "INTERSECT", "WINDOW")
+_TABLE_REF = re.compile(
+    r"""(?:FROM|JOIN)\s+(?:"((?:[^"]|"")+)"|`([^`]+)`|\[([^\]]+)\]|(\w+))"""
+    r"(?:\s+(?:AS\s+)?(?!(?:" + "|".join(_NOT_ALIAS) + r")\b)(\w+))?",
+    re.IGNORECASE,
+)
+_EQUALITY = r"(?:==?|\bIN\b|\bIS\b(?!\s+NOT))"
+_RANGE = r"(?:<=|>=|<|>|\bBETWEEN\b)"
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _column_pattern(column):
+    """A column reference, bare or quoted, optionally qualified with a table or alias."""
+    quoted = re.escape(_quote(column))
+    if re.fullmatch(r"\w+", column):
+        return rf"(?:(?<![\w\"])\b{re.escape(column)}\b(?![\w\"])|{quoted})"
+    return quoted
+
+def table_references(sql):
+    """Maps each table named in FROM/JOIN to the names it goes by in the query (itself and any alias)."""
+    references = {}
+    for match in _TABLE_REF.finditer(_QUOTED_STRING.sub("''", sql)):
+        table = next(g for g in match.groups()[:4] if g).replace('""', '"')
+        names = references.setdefault(table, {table})
+        if match.group(5):
+            names.add(match.group(5))
+    return references
+
+def _clauses(sql):
+    """Splits a query into `(KEYWORD, text)` pieces, e.g. ("WHERE", ' "Status" = ...')."""
+    parts = _CLAUSE.split(sql)
+    return [(re.sub(r"\s+", " ", parts[i].upper()), parts[i + 1]) for i in range(1, len(parts) - 1, 2)]
+
+def index_candidates(sql, tables):
+    """
+    The index each table referenced by `sql` would need, as `{table: columns}`:
+    equality-filtered and join columns first, then one range-filtered or
+    ORDER BY column. `tables` maps table names to their column names.
+    """
+    text = _QUOTED_STRING.sub("''", sql)
+    clauses = _clauses(text)
+    candidates = {}
+
+    for table in set(table_references(sql)) & set(tables):
+        equality, ranges, order = [], [], []
+        for column in tables[table]:
+            pattern = _column_pattern(column)
+            for keyword, body in clauses:
+                if keyword in ("WHERE", "ON", "HAVING"):
+                    if re.search(pattern + r"\s*" + _EQUALITY, body, re.IGNORECASE) or \
+                            (keyword == "ON" and re.search(r"=\s*(?:\w+\.)?" + pattern, body, re.IGNORECASE)):
+                        equality.append(column)
+                    elif re.search(pattern + r"\s*" + _RANGE, body, re.IGNORECASE):
+                        ranges.append(column)
+                elif keyword == "ORDER BY" and re.search(pattern, body, re.IGNORECASE):
+                    order.append(column)
+
+        columns = list(dict.fromkeys(equality))[:2]
+        tail = [c for c in ranges + order if c not in columns]
+        columns += tail[:1]
+        if columns:
+            candidates[table] = tuple(columns)
+    return candidates
+
+def index_name(table, columns):
+    digest = hashlib.sha1("\0".join((table,) + tuple(columns)).encode()).hexdigest()[:12]
+    return f"{INDEX_PREFIX}{re.sub(r'[^0-9a-zA-Z]+', '_', table)[:30]}_{digest}"
+
+
+class IndexAdvisor:
+    """
+    `workload_db` stores query counts across restarts. An index is created
+    once the queries that need it ran at least `min_queries` times within the
+    last `window_days`; each table gets at most `max_per_table` of them.
+    Counts are buffered in memory and written to `workload_db` on each
+    `apply`, or as soon as `max_pending` distinct queries are buffered.
+    """
+
+    def __init__(self, workload_db, min_queries=2, max_per_table=4, window_days=30, max_queries=500, max_pending=1000):
+        self.workload_db = workload_db
+        self.min_queries = min_queries
+        self.max_per_table = max_per_table
+        self.window_days = window_days
+        self.max_queries = max_queries
+        self.max_pending = max_pending
+        self.last_report = {}
+        self._pending = Counter()
+        # Indexes the query planner ignored once created; not retried until restart.
+        self._unused = set()
+        self._lock = threading.Lock()
+
+    def record(self, sql):
+        """Counts a query that ran against the sheets database."""
+        with self._lock:
+            self._pending[sql.strip()] += 1
+            if len(self._pending) < self.max_pending:
+                return
+            # Syncs may be rare (or every one may find nothing changed), so
+            # `apply` alone would let the buffer grow without bound.
+            pending, self._pending = self._pending, Counter()
+        self._flush(pending).close()
+
+    def _flush(self, pending):
+        """Adds `pending` to the stored counts and returns the open workload connection."""
+        conn = sqlite3.connect(self.workload_db, isolation_level=None)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS workload (sql TEXT PRIMARY KEY, count INTEGER, last_seen REAL)")
+            now = time.time()
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO workload VALUES (?, ?, ?) "
+                "ON CONFLICT(sql) DO UPDATE SET count = count + excluded.count, last_seen = excluded.last_seen",
+                [(sql, count, now) for sql, count in pending.items()],
+            )
+            conn.execute("DELETE FROM workload WHERE last_seen < ?", (now - self.window_days * 86400,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _workload(self):
+        """Flushes the pending counts and returns the recent `(sql, count)` workload."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+
+        conn = self._flush(pending)
+        try:
+            return conn.execute(
+                "SELECT sql, count FROM workload ORDER BY count DESC LIMIT ?", (self.max_queries,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _needs_index(cursor, sql, names):
+        """True when the plan scans the table (known as any of `names`), or reads it through an advisor index."""
+        try:
+            plan = [row[-1] for row in cursor.execute("EXPLAIN QUERY PLAN " + sql)]
+        except (sqlite3.Error, sqlite3.Warning):
+            return False
+        for step in plan:
+            # "SCAN Tasks", "SEARCH t USING INDEX ...", or "SCAN TABLE Tasks" on older SQLite
+            match = re.match(r"(SCAN|SEARCH) (?:TABLE )?(.+?)(?: USING .*)?$", step)
+            if not match or match.group(2) not in names:
+                continue
+            if INDEX_PREFIX in step or (match.group(1) == "SCAN" and "INDEX" not in step):
+                return True
+        return False
+
+    def recommend(self, cursor, workload):
+        """The indexes the workload calls for, as `{name: (table, columns)}`."""
+        tables = {}
+        for (table,) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                                      "AND sql NOT LIKE 'CREATE VIRTUAL TABLE%'").fetchall():
+            tables[table] = [row[1] for row in cursor.execute(f"PRAGMA table_info({_quote(table)})").fetchall()]
+
+        weights = Counter()
+        for sql, count in workload:
+            references = table_references(sql)
+            for table, columns in index_candidates(sql, tables).items():
+                if self._needs_index(cursor, sql, references[table]):
+                    weights[(table, columns)] += count
+
+        chosen = {}
+        # Heaviest first; an index whose columns lead another chosen one is redundant.
+        for (table, columns), weight in sorted(weights.items(), key=lambda item: (-item[1], -len(item[0][1]))):
+            name = index_name(table, columns)
+            if weight < self.min_queries or name in self._unused:
+                continue
+            if any(t == table and c[:len(columns)] == columns for t, c in chosen.values()):
+                continue
+            for covered in [n for n, (t, c) in chosen.items() if t == table and columns[:len(c)] == c]:
+                del chosen[covered]
+            if sum(t == table for t, _ in chosen.values()) < self.max_per_table:
+                chosen[name] = (table, columns)
+        return chosen
+
+    @staticmethod
+    def _used_indexes(cursor, workload):
+        """Names of the advisor indexes that some query in the workload is planned to use."""
+        used = set()
+        for sql, _ in workload:
+            try:
+                plan = cursor.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+            except (sqlite3.Error, sqlite3.Warning):
+                continue
+            for row in plan:
+                used.update(re.findall(r"INDEX (" + INDEX_PREFIX + r"\w+)", row[-1]))
+        return used
+
+    def apply(self, cursor, tables_changed=False):
+        """
+        Creates and drops advisor indexes on an open write transaction and
+        runs ANALYZE when anything changed. Returns the report also kept in
+        `last_report`.
+        """
+        start = time.perf_counter()
+        workload = self._workload()
+        desired = self.recommend(cursor, workload)
+        existing = {name for (name,) in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE ?", (INDEX_PREFIX + "%",)
+        ).fetchall()}
+
+        dropped = sorted(existing - set(desired))
+        for name in dropped:
+            cursor.execute(f"DROP INDEX IF EXISTS {_quote(name)}")
+        created = {}
+        for name, (table, columns) in desired.items():
+            if name not in existing:
+                cursor.execute(f"CREATE INDEX {_quote(name)} ON {_quote(table)} ({', '.join(map(_quote, columns))})")
+                created[name] = f"{table}({', '.join(columns)})"
+
+        if created or dropped or tables_changed:
+            # Bounds the rows ANALYZE samples per index, so it stays quick on big tables.
+            cursor.execute("PRAGMA analysis_limit = 1000")
+            cursor.execute("ANALYZE")
+
+        # With fresh statistics the planner may still prefer a scan (e.g. a
+        # filter that matches a large share of the rows); drop those indexes.
+        unused = set(created) - self._used_indexes(cursor, workload) if created else set()
+        for name in unused:
+            cursor.execute(f"DROP INDEX {_quote(name)}")
+            self._unused.add(name)
+
+        self.last_report = {
+            "indexes": len(desired) - len(unused),
+            "created": [label for name, label in created.items() if name not in unused],
+            "unused": sorted(created[name] for name in unused),
+            "dropped": dropped,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        return self.last_report
@@ -0,0 +1,255 @@
+"""
+Local intent classification that runs ahead of the LLM classifier.
+
+`IntentClassifier.classify` decides between "DatabaseQuery" and
+"Conversation" from three signals: small-talk and data-question keywords,
+words that name a table or column in the current schema, and a small naive
+Bayes model over word unigrams and bigrams. It returns None when none of them
+is confident, and the caller falls back to the LLM tool-call classifier. The
+model starts from a built-in seed set and keeps learning from the intents the
+LLM picks for those fallbacks.
+"""
+import math
+import re
+import statistics
+import threading
+from collections import Counter, deque
+
+DATABASE_QUERY = "DatabaseQuery"
+CONVERSATION = "Conversation"
+
+_WORD = re.compile(r"[a-z0-9]+")
+_CAMEL = re.compile(r"(?<=[a-z])(?=[A-Z])")
+
+# A message made only of these words is small talk.
+SMALL_TALK_WORDS = {
+    "hi", "hii", "hello", "hey", "hola", "namaste", "yo", "hlo",
+    "good", "morning", "afternoon", "evening", "night", "day",
+    "thanks", "thank", "thx", "ty", "you", "u", "so", "much", "a", "lot", "very",
+    "ok", "okay", "k", "cool", "great", "nice", "awesome", "perfect", "got", "it",
+    "bye", "goodbye", "see", "ya", "later", "take", "care", "there", "bot", "buddy",
+    "how", "are", "doing", "who", "what", "can", "do", "yes", "no", "sure", "please",
+}
+
+# Words that ask for data rather than chat. Nouns that merely name the data
+# ("status", "sheet") are left out: "how do I change the status in the sheet"
+# is about the data without asking for any.
+DATA_WORDS = {
+    "count", "total", "sum", "average", "avg", "mean", "list", "show", "number",
+    "many", "much", "which", "most", "least", "highest", "lowest", "top", "latest",
+    "oldest", "pending", "completed", "complete", "done", "overdue", "open", "closed",
+    "assigned", "due", "between", "per", "each", "group", "filter", "greater", "less", "more",
+}
+
+# Column and table words too generic to count as a schema match on their own.
+GENERIC_SCHEMA_WORDS = {"id", "no", "name", "date", "time", "type", "data", "sheet", "value", "s"}
+
+SEED_EXAMPLES = [
+    (DATABASE_QUERY, "how many tasks are pending"),
+    (DATABASE_QUERY, "show me all completed tasks"),
+    (DATABASE_QUERY, "list the tasks assigned to john"),
+    (DATABASE_QUERY, "which tasks are overdue"),
+    (DATABASE_QUERY, "what is the total number of rows in the sheet"),
+    (DATABASE_QUERY, "count tasks by status"),
+    (DATABASE_QUERY, "who has the most pending tasks"),
+    (DATABASE_QUERY, "what is the average hours per task"),
+    (DATABASE_QUERY, "give me the high priority tasks"),
+    (DATABASE_QUERY, "tasks due this week"),
+    (DATABASE_QUERY, "how many orders were placed last month"),
+    (DATABASE_QUERY, "what is the status of task 42"),
+    (DATABASE_QUERY, "find all entries for the sales team"),
+    (DATABASE_QUERY, "which employee completed the most tasks"),
+    (DATABASE_QUERY, "sum of amount for pending invoices"),
+    (DATABASE_QUERY, "show the latest ten records"),
+    (DATABASE_QUERY, "kitne tasks pending hai"),
+    (DATABASE_QUERY, "pending tasks ki list do"),
+    (DATABASE_QUERY, "how many tasks did priya finish today"),
+    (DATABASE_QUERY, "what are the open issues with urgent priority"),
+    (CONVERSATION, "hi"),
+    (CONVERSATION, "hello how are you"),
+    (CONVERSATION, "thanks a lot"),
+    (CONVERSATION, "thank you so much"),
+    (CONVERSATION, "good morning"),
+    (CONVERSATION, "who are you"),
+    (CONVERSATION, "what can you do"),
+    (CONVERSATION, "what is the date today"),
+    (CONVERSATION, "what time is it"),
+    (CONVERSATION, "tell me a joke"),
+    (CONVERSATION, "aaj kya date hai"),
+    (CONVERSATION, "bye see you later"),
+    (CONVERSATION, "ok great"),
+    (CONVERSATION, "can you help me write an email"),
+    (CONVERSATION, "what is your name"),
+    (CONVERSATION, "explain what a pivot table is"),
+    (CONVERSATION, "write an email to the team about the deadline"),
+    (CONVERSATION, "how many days are in a month"),
+    (CONVERSATION, "how do i add a new column to the sheet"),
+    (CONVERSATION, "how can i update a task"),
+    (CONVERSATION, "what does this field mean"),
+    (CONVERSATION, "how is the weather"),
+    (CONVERSATION, "nice work"),
+    (CONVERSATION, "you are awesome"),
+    (CONVERSATION, "kaise ho"),
+]
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+def _features(words):
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+def schema_words(tables):
+    """Lowercase words that make up the table and column names, e.g. "TaskID" -> {"task"}."""
+    words = set()
+    for table, columns in tables.items():
+        for name in [table, *columns]:
+            words.update(_words(_CAMEL.sub(" ", name)))
+    words -= GENERIC_SCHEMA_WORDS
+    # Plural and singular forms both match.
+    return words | {w[:-1] for w in words if w.endswith("s")} | {w + "s" for w in words}
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes with add-one smoothing over word unigrams and bigrams."""
+
+    def __init__(self, examples=()):
+        self.word_counts = {}
+        self.totals = Counter()
+        self.documents = Counter()
+        self.vocabulary = set()
+        for label, text in examples:
+            self.learn(text, label)
+
+    def learn(self, text, label):
+        features = _features(_words(text))
+        self.word_counts.setdefault(label, Counter()).update(features)
+        self.totals[label] += len(features)
+        self.documents[label] += 1
+        self.vocabulary.update(features)
+
+    def forget(self, text, label):
+        """Undoes `learn(text, label)`."""
+        features = _features(_words(text))
+        counts = self.word_counts[label]
+        counts.subtract(features)
+        self.totals[label] -= len(features)
+        self.documents[label] -= 1
+        for feature in set(features):
+            if counts[feature] <= 0:
+                del counts[feature]
+                if not any(feature in other for other in self.word_counts.values()):
+                    self.vocabulary.discard(feature)
+
+    def predict(self, text):
+        """Returns `(label, probability)` for the most likely label."""
+        features = _features(_words(text))
+        n_documents = sum(self.documents.values())
+        size = len(self.vocabulary) + 1
+        scores = {}
+        for label, counts in self.word_counts.items():
+            score = math.log(self.documents[label] / n_documents)
+            denominator = self.totals[label] + size
+            for feature in features:
+                score += math.log((counts[feature] + 1) / denominator)
+            scores[label] = score
+
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+
+class IntentClassifier:
+    """
+    Rules first, then the model; None means "ask the LLM".
+
+    The schema rule only decides when the model also leans to DatabaseQuery
+    with at least `schema_confidence`. The model learns from at most
+    `max_learned` LLM-labelled questions, the most recent ones, on top of the
+    seed examples.
+
+    `stats()` reports how many requests were decided locally and the median
+    classification latency of each path, as recorded by the caller.
+    """
+
+    def __init__(self, confidence=0.9, schema_confidence=0.8, max_learned=2000, latency_window=1000):
+        self.confidence = confidence
+        self.schema_confidence = schema_confidence
+        self.model = NaiveBayes(SEED_EXAMPLES)
+        self._learned = deque()
+        self.max_learned = max_learned
+        self.decisions = Counter()
+        self._latencies = {"local": deque(maxlen=latency_window), "llm": deque(maxlen=latency_window)}
+        self._schema_key = None
+        self._schema_words = set()
+        self._lock = threading.Lock()
+
+    def _schema(self, tables):
+        key = tuple(sorted((table, tuple(columns)) for table, columns in tables.items()))
+        if key != self._schema_key:
+            self._schema_words = schema_words(tables)
+            self._schema_key = key
+        return self._schema_words
+
+    def classify(self, question, chat_history, tables):
+        """Returns the intent, or None when the LLM should decide. Also records which rule fired."""
+        words = _words(question)
+        with self._lock:
+            # Short follow-ups ("and for john?", "yes" to an offer to run a query)
+            # depend on the conversation.
+            if chat_history and len(words) < 4:
+                self.decisions["llm"] += 1
+                return None
+
+            if words and all(w in SMALL_TALK_WORDS for w in words) and not (set(words) & DATA_WORDS):
+                self.decisions["small_talk"] += 1
+                return CONVERSATION
+
+            label, probability = self.model.predict(question)
+
+            # A schema word alone, like "priority" in "explain what priority
+            # means", is not a request for data; it needs a data word besides,
+            # and the model must not doubt it ("how many hours are in a week",
+            # "write an email to john about his pending tasks").
+            schema_hits = set(words) & self._schema(tables)
+            if (schema_hits and (set(words) & DATA_WORDS) - schema_hits
+                    and label == DATABASE_QUERY and probability >= self.schema_confidence):
+                self.decisions["schema"] += 1
+                return DATABASE_QUERY
+            if probability >= self.confidence:
+                self.decisions["model"] += 1
+                return label
+
+            self.decisions["llm"] += 1
+            return None
+
+    def learn(self, question, intent):
+        """Adds an LLM-classified question to the model's training data, forgetting the oldest past `max_learned`."""
+        with self._lock:
+            self.model.learn(question, intent)
+            self._learned.append((question, intent))
+            if len(self._learned) > self.max_learned:
+                self.model.forget(*self._learned.popleft())
+
+    def record(self, path, seconds):
+        """Records the latency of a classification that took the "local" or "llm" path."""
+        with self._lock:
+            self._latencies[path].append(seconds)
+
+    def stats(self):
+        with self._lock:
+            decided = sum(self.decisions.values())
+            local = decided - self.decisions["llm"]
+            latencies = {path: list(values) for path, values in self._latencies.items()}
+
+        def p50_ms(values):
+            return round(statistics.median(values) * 1000, 3) if values else None
+
+        return {
+            "requests": decided,
+            "decisions": dict(self.decisions),
+            "skipped_llm_fraction": round(local / decided, 3) if decided else None,
+            "p50_local_ms": p50_ms(latencies["local"]),
+            "p50_llm_ms": p50_ms(latencies["llm"]),
+            "p50_ms": p50_ms(latencies["local"] + latencies["llm"]),
+        }
@@ -1,23 +1,38 @@
 import os
+import asyncio
+import json
 
-from fastapi import FastAPI, BackgroundTasks, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 from langchain_core.messages import AIMessage, HumanMessage
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 
-from agent import graph
-from script import sync_database
+from agent import graph, build_graph, next_turn, astream_answer, schema_cache, query_cache, result_cache, intent_classifier, history_manager, result_downloads, direct_answers
+from script import sync_database, sync_stats
+from scheduler import SyncScheduler
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 load_dotenv()
 
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 
+# Webhooks arriving within this many seconds of each other share one sync.
+SYNC_COALESCE_SECONDS = float(os.getenv("SYNC_COALESCE_SECONDS", "2"))
+sync_scheduler = SyncScheduler(sync_database, window=SYNC_COALESCE_SECONDS)
+
+# Conversation state of requests that carry a session_id, checkpointed by LangGraph.
+SESSION_DB = os.getenv("SESSION_DB", "sessions.db")
+session_graph = None
+
 class ChatRequest(BaseModel):
     question: str 
-    chat_history: List[Dict[str, str]] # e.g., [{"type": "human", "content": "hi"}]
+    chat_history: List[Dict[str, str]] = [] # e.g., [{"type": "human", "content": "hi"}]
+    # With a session_id the server keeps the history; chat_history is ignored.
+    session_id: Optional[str] = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -25,10 +40,15 @@ async def lifespan(app: FastAPI):
     print("🚀 Application startup: Running initial database sync...")
     sync_database()
     print("✅ Initial database sync complete. Application is ready.")
-    
-    yield
+
+    global session_graph
+    async with AsyncSqliteSaver.from_conn_string(SESSION_DB) as checkpointer:
+        session_graph = build_graph(checkpointer=checkpointer)
+        yield
+        session_graph = None
     
     # Code here runs on shutdown (optional)
+    sync_scheduler.shutdown()
     print("👋 Application shutdown.")
 
 app = FastAPI(title="Botivate Rag Agent API", lifespan=lifespan)
@@ -46,13 +66,23 @@ async def root():
     return {"status": "ok"}
 
 
-@app.post("/chat")
-async def chat_with_agent(request: ChatRequest):
-    """
-    The main endpoint to interact with the agent.
-    It accepts a question and the conversation history.
-    """
+@app.get("/stats")
+async def stats():
+    """Cache and sync counters, for checking how much work is being saved."""
+    return {
+        "schema_cache": schema_cache.stats(),
+        "query_cache": query_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "intent_classifier": intent_classifier.stats(),
+        "history": history_manager.stats(),
+        "direct_answers": {"answered": direct_answers.answered},
+        "sync": sync_scheduler.stats(),
+        "sync_content": sync_stats(),
+    }
+
 
+def build_initial_state(request: ChatRequest):
+    """Converts the request's chat history into messages and builds the graph input."""
     history_messages = []
 
     for msg in request.chat_history:
@@ -60,31 +90,102 @@ async def chat_with_agent(request: ChatRequest):
             history_messages.append(HumanMessage(content=msg.get("content")))
         elif msg.get("type") == "ai":
             history_messages.append(AIMessage(content=msg.get("content")))
-        
-    initial_state = {
+
+    return {
         "question": request.question,
         "chat_history": history_messages
     }
 
-    final_state = graph.invoke(initial_state)
+
+async def prepare_run(request: ChatRequest):
+    """
+    The graph, its input and its config for a request. Session requests run
+    on the checkpointed graph and continue from the session's stored state.
+    """
+    if request.session_id is None:
+        return graph, build_initial_state(request), None
+
+    if session_graph is None:
+        raise HTTPException(status_code=503, detail="Sessions are not available yet")
+    if not 0 < len(request.session_id) <= 128:
+        raise HTTPException(status_code=400, detail="session_id must be 1-128 characters")
+
+    config = {"configurable": {"thread_id": request.session_id}}
+    snapshot = await session_graph.aget_state(config)
+    return session_graph, await asyncio.to_thread(next_turn, snapshot.values, request.question), config
+
+
+@app.post("/chat")
+async def chat_with_agent(request: ChatRequest):
+    """
+    The main endpoint to interact with the agent.
+    It accepts a question and either the conversation history or a session_id.
+    """
+
+    agent_graph, state, config = await prepare_run(request)
+    final_state = await agent_graph.ainvoke(state, config)
 
     return {"answer": final_state.get('answer', "Sorry, I encountered an error.")}
 
 
+@app.post("/chat/stream")
+async def stream_chat_with_agent(request: ChatRequest):
+    """
+    Same as /chat, but answers with Server-Sent Events: `intent`, `query` and
+    `rows` as each stage finishes, `token` for every piece of the answer, and a
+    final `answer` event with the full text.
+    """
+
+    agent_graph, state, config = await prepare_run(request)
+
+    async def event_stream():
+        async for event, data in astream_answer(state, agent_graph, config):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/results/{result_id}")
+async def download_result(result_id: str):
+    """The full rows of a result that was too large to summarize, as CSV."""
+    path = result_downloads.get(result_id)
+    try:
+        # Opened here, so the download survives the entry being evicted meanwhile.
+        file = open(path, "rb") if path else None
+    except FileNotFoundError:
+        file = None
+    if file is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+
+    def csv_chunks():
+        with file:
+            yield from iter(lambda: file.read(64 * 1024), b"")
+
+    return StreamingResponse(
+        csv_chunks(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="result-{result_id[:8]}.csv"'},
+    )
+
+
 @app.post("/webhook/sync")
-async def sync_db(request: Request, background_tasks: BackgroundTasks):
+async def sync_db(request: Request):
     """
     Webhook to receive update notifications from Google Apps Script.
-    It runs the database sync process in the background.
+    It schedules a database sync in the background; bursts of edits are
+    coalesced and only one sync runs at a time.
     """
     # Security: Check for a secret token in the headers
     auth_token = request.headers.get('X-Webhook-Secret')
     if not WEBHOOK_SECRET or auth_token != WEBHOOK_SECRET:
         raise HTTPException(status_code=403, detail="Forbidden: Invalid or missing token")
 
-    print("✅ Webhook received. Starting DB sync in the background.")
-    # Add the sync function as a background task
-    background_tasks.add_task(sync_database)
+    print("✅ Webhook received. Scheduling DB sync in the background.")
+    sync_scheduler.request()
     
     # Immediately return a response so Google Script isn't kept waiting
-    return {"message": "Database update process started in the background."}
+    return {"message": "Database update process scheduled in the background."}
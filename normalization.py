@@ -0,0 +1,212 @@
+"""
+Canonical companion columns for values the sheet spells several ways.
+
+People write 'Done', 'Yes' or 'Completed' for the same status and 'john.doe'
+or 'johnd' for the same assignee. Matching all of those at query time takes
+IN lists and LOWER()/LIKE predicates that cannot use an index. During sync,
+`ValueNormalizer` instead writes a `<column>_canonical` column next to each
+configured column, holding one lowercase spelling per meaning, and
+`ensure_indexes` indexes it, so a question becomes an equality lookup.
+
+Rules map a column name (matched case-insensitively in every sheet) to:
+
+    {"values": {"completed": ["done", "yes"], ...}, "username": false}
+
+`values` maps each canonical value to its aliases. A value that matches no
+alias is case-folded with its whitespace collapsed. With `username`, email
+domains are dropped and "first.last" becomes "firstl", the short form,
+unless another name in the column shortens to the same thing ("John Smith"
+and "john.sampson" are both "johns"): those keep their full "first.last"
+form, so two people are never counted as one.
+"""
+import hashlib
+import json
+import re
+
+CANONICAL_SUFFIX = "_canonical"
+# Distinct canonical values listed per column in the schema prompt.
+DESCRIBE_MAX_VALUES = 20
+
+# Exactly the equivalences of the SQL generator's data dictionary.
+DEFAULT_RULES = {
+    "Status": {"values": {"completed": ["done", "yes"]}},
+    "Priority": {"values": {"high": ["urgent", "h"], "low": ["l"]}},
+    "Assignee": {"username": True},
+}
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _fold(value):
+    return " ".join(str(value).split()).casefold()
+
+def load_rules(path):
+    """The rules from the JSON file at `path`, or DEFAULT_RULES when there is none."""
+    if not path:
+        return DEFAULT_RULES
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ValueNormalizer:
+    """Computes the canonical companion values for the columns `rules` names."""
+
+    def __init__(self, rules):
+        self.rules = {}
+        for column, rule in rules.items():
+            aliases = {}
+            for canonical, spellings in rule.get("values", {}).items():
+                for spelling in [canonical, *spellings]:
+                    aliases[_fold(spelling)] = _fold(canonical)
+            self.rules[column.casefold()] = (aliases, bool(rule.get("username")))
+
+    @staticmethod
+    def _name_parts(folded):
+        return [p for p in re.split(r"[\s._-]+", folded.split("@", 1)[0]) if p]
+
+    def _names(self, column, values):
+        """`(short form, full name)` for the multi-part names among `values` of a username column."""
+        aliases, username = self.rules[column.casefold()]
+        if not username:
+            return
+        for value in values:
+            if value is None or value == "":
+                continue
+            folded = _fold(value)
+            parts = self._name_parts(folded)
+            if folded not in aliases and len(parts) > 1:
+                yield parts[0] + "".join(p[0] for p in parts[1:]), ".".join(parts)
+
+    def learn(self, names, column, values):
+        """
+        Adds the multi-part names among `values` of `column` to `names`,
+        `{column: {short form: {full names}}}`, the state `canonical` checks
+        for short forms shared by different people.
+        """
+        for short, full in self._names(column, values):
+            names.setdefault(column, {}).setdefault(short, set()).add(full)
+
+    @staticmethod
+    def ambiguous(names, column):
+        """The short forms more than one full name in `names` shortens to."""
+        return {short for short, fulls in names.get(column, {}).items() if len(fulls) > 1}
+
+    def canonical(self, column, value, ambiguous=frozenset()):
+        """
+        The canonical form of `value` in `column`; None for an empty cell.
+        Names whose short form is in `ambiguous` keep their full form.
+        """
+        if value is None or value == "":
+            return None
+        aliases, username = self.rules[column.casefold()]
+        folded = _fold(value)
+        if folded in aliases:
+            return aliases[folded]
+        if not username:
+            return folded
+        parts = self._name_parts(folded)
+        if len(parts) < 2:
+            return "".join(parts)
+        short = parts[0] + "".join(p[0] for p in parts[1:])
+        return ".".join(parts) if short in ambiguous else short
+
+    def is_username(self, column):
+        return column.casefold() in self.rules and self.rules[column.casefold()][1]
+
+    def companions(self, columns):
+        """`(index, source column, companion column)` for each column of a sheet that has a rule."""
+        taken = set(columns)
+        return [
+            (i, column, column + CANONICAL_SUFFIX)
+            for i, column in enumerate(columns)
+            if column.casefold() in self.rules and column + CANONICAL_SUFFIX not in taken
+        ]
+
+    def extend(self, values, companions, names=None):
+        """
+        Appends the companion values to each row tuple of `values`. Short
+        forms are checked against the names in `values` plus those already
+        in `names` (see `learn`), which collects them across the batches of
+        a streamed sheet.
+        """
+        if not companions:
+            return values
+        names = {} if names is None else names
+        for i, column, _ in companions:
+            self.learn(names, column, (row[i] for row in values))
+        ambiguous = {column: self.ambiguous(names, column) for _, column, _ in companions}
+        return [(*row, *(self.canonical(column, row[i], ambiguous[column]) for i, column, _ in companions)) for row in values]
+
+    def rewrite_ambiguous(self, cursor, table, companions, names):
+        """
+        Rewrites companion values written as a short form that a later batch
+        of the same sheet made ambiguous. Returns the number of rows changed.
+        """
+        changed = set()
+        for _, column, companion in companions:
+            ambiguous = self.ambiguous(names, column)
+            if not ambiguous:
+                continue
+            placeholders = ", ".join(["?"] * len(ambiguous))
+            rows = cursor.execute(
+                f"SELECT rowid, {_quote(column)}, {_quote(companion)} FROM {_quote(table)} "
+                f"WHERE {_quote(companion)} IN ({placeholders})", sorted(ambiguous)
+            ).fetchall()
+            updates = [(new, rowid) for rowid, value, old in rows if (new := self.canonical(column, value, ambiguous)) != old]
+            cursor.executemany(f"UPDATE {_quote(table)} SET {_quote(companion)} = ? WHERE rowid = ?", updates)
+            changed.update(rowid for _, rowid in updates)
+        return len(changed)
+
+
+def index_name(table, column):
+    digest = hashlib.sha1(f"{table}\0{column}".encode()).hexdigest()[:12]
+    return f"canonical_{re.sub(r'[^0-9a-zA-Z]+', '_', table)[:30]}_{digest}"
+
+def canonical_columns(cursor, table):
+    return [name for _, name, *_ in cursor.execute(f"PRAGMA table_info({_quote(table)})") if name.endswith(CANONICAL_SUFFIX)]
+
+def ensure_indexes(cursor, table):
+    """Indexes every companion column of `table`; a no-op for the ones that already are."""
+    for column in canonical_columns(cursor, table):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {_quote(index_name(table, column))} ON {_quote(table)} ({_quote(column)})")
+
+def describe(cursor, tables, normalizer=None):
+    """
+    The schema prompt section listing the companion columns and their values,
+    or "" when there are none. Only the first DESCRIBE_MAX_VALUES values are
+    listed, so for the username columns of `normalizer` it also states how a
+    name is folded, which lets the model write the value for anyone unlisted.
+    """
+    lines, example = [], None
+    for table in tables:
+        for column in canonical_columns(cursor, table):
+            values = [value for (value,) in cursor.execute(
+                f"SELECT DISTINCT {_quote(column)} FROM {_quote(table)} WHERE {_quote(column)} IS NOT NULL "
+                f"ORDER BY 1 LIMIT {DESCRIBE_MAX_VALUES + 1}"
+            )]
+            listed = ", ".join("'" + str(value).replace("'", "''") + "'" for value in values[:DESCRIBE_MAX_VALUES])
+            more = ", ..." if len(values) > DESCRIBE_MAX_VALUES else ""
+            source = column[:-len(CANONICAL_SUFFIX)]
+            lines.append(f"- {_quote(table)}.{_quote(column)} is {_quote(source)} normalized (indexed): {listed}{more}")
+            if normalizer is not None and normalizer.is_username(source):
+                lines.append(
+                    f"  Names in {_quote(column)} are lowercase, without any email domain, as the first name followed by "
+                    "the initials of the other parts ('John Smith' and 'john.smith@example.com' become 'johns'); a "
+                    "single name stays whole ('Priya' becomes 'priya'). Two people with the same short form each keep "
+                    "'first.last' ('john.smith'). For a name not listed above, match both forms, e.g. "
+                    f"{_quote(column)} IN ('johns', 'john.smith')."
+                )
+            if example is None and values:
+                example = f"{_quote(column)} = '" + str(values[0]).replace("'", "''") + "'"
+    if not lines:
+        return ""
+    return "\n".join([
+        "",
+        "--- Canonical Values ---",
+        *lines,
+        "- Filter and group on these columns with = and the values above"
+        + (f" (for example {example})" if example else "")
+        + " instead of IN lists of spellings, LOWER() or LIKE on the original column. Show the original column to the user.",
+        "------------------------",
+    ])
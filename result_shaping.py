@@ -0,0 +1,171 @@
+"""
+Keeps query results that are too large for the summarizer prompt out of it.
+
+`shape_result` passes a small result through unchanged (formatted like
+`SQLDatabase.run`). A result over the budget is replaced by a digest computed
+locally: the row count, numeric column statistics, value counts for
+categorical columns with group-by totals of the numeric ones, and a few
+evenly spaced sample rows.
+"""
+from collections import Counter
+
+from sql_guard import format_rows
+
+# A categorical column with at most this many distinct values gets group-by totals.
+GROUP_BY_MAX_VALUES = 12
+TOP_VALUES = 5
+SAMPLE_ROWS = 10
+MAX_CELL_CHARS = 80
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _number(value, grouped=True):
+    comma = "," if grouped else ""
+    if isinstance(value, float):
+        return f"{value:{comma}.0f}" if value.is_integer() else f"{value:{comma}.2f}"
+    return f"{value:{comma}}"
+
+def _cell(value):
+    text = str(value)
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS] + "..."
+
+def _numeric_columns(columns, rows):
+    numeric = []
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows if row[i] is not None]
+        if values and all(_is_number(v) for v in values):
+            numeric.append((i, column, values))
+    return numeric
+
+def _is_identifier(values):
+    """Distinct integers, like a row number or TaskID, are not worth totalling."""
+    return all(isinstance(v, int) for v in values) and len(set(values)) == len(values)
+
+def sample_rows(rows, n=SAMPLE_ROWS):
+    """`n` rows spread evenly over the result, first and last included."""
+    if len(rows) <= n:
+        return list(rows)
+    step = (len(rows) - 1) / (n - 1)
+    return [rows[round(i * step)] for i in range(n)]
+
+def digest(columns, rows):
+    """A compact text description of a large result."""
+    lines = [
+        f"The query returned {len(rows):,} rows with the columns {', '.join(columns)}. "
+        "That is too many to list, so this is a digest computed over all of them."
+    ]
+
+    numeric = _numeric_columns(columns, rows)
+    numeric_indexes = {i for i, _, _ in numeric}
+    if numeric:
+        lines.append("Numeric columns:")
+        for _, column, values in numeric:
+            lines.append(
+                f"- {column}: {len(values):,} values, min {_number(min(values))}, max {_number(max(values))}, "
+                f"mean {_number(sum(values) / len(values))}, sum {_number(sum(values))}"
+            )
+
+    # At most two numeric columns, identifiers excluded, are totalled per group.
+    measures = [m for m in numeric if not _is_identifier(m[2])][:2]
+    categorical = [(i, column) for i, column in enumerate(columns) if i not in numeric_indexes]
+    if categorical:
+        lines.append("Other columns:")
+    for i, column in categorical:
+        counts = Counter(row[i] for row in rows)
+        if len(counts) == len(rows):
+            lines.append(f"- {column}: every value is different")
+            continue
+        top = ", ".join(f"{_cell(value)}: {count:,}" for value, count in counts.most_common(TOP_VALUES))
+        lines.append(f"- {column}: {len(counts):,} distinct values; most common {top}")
+
+        if len(counts) <= GROUP_BY_MAX_VALUES:
+            for j, numeric_column, _ in measures:
+                totals = Counter()
+                for row in rows:
+                    if row[j] is not None:
+                        totals[row[i]] += row[j]
+                by_group = ", ".join(f"{_cell(value)}: {_number(total)}" for value, total in totals.most_common())
+                lines.append(f"  - total {numeric_column} by {column}: {by_group}")
+
+    samples = [tuple(_cell(value) if isinstance(value, str) else value for value in row) for row in sample_rows(rows)]
+    lines.append(f"Sample rows ({len(samples)} of {len(rows):,}, evenly spaced): {samples}")
+    return "\n".join(lines)
+
+def shape_result(columns, rows, max_rows, max_chars):
+    """
+    Returns `(result, shaped)`: the rows formatted as usual when they fit in
+    `max_rows` rows and `max_chars` characters, otherwise a digest.
+    """
+    if len(rows) <= max_rows:
+        text = format_rows(rows)
+        if len(text) <= max_chars:
+            return text, False
+    return digest(columns, rows), True
+
+class DirectAnswerRenderer:
+    """
+    Renders the answer to a result whose shape makes it obvious, so the
+    summarizer call can be skipped.
+
+    `shapes` enables "scalar" (one value), "table" (at most `max_rows` rows
+    of at most `max_columns` columns, as a markdown table) and "empty" (no
+    rows). `templates` maps each shape to a format string with `{value}`
+    (scalar) or `{table}` (table) placeholders.
+    """
+
+    DEFAULT_TEMPLATES = {
+        "scalar": "The answer is **{value}**.",
+        "table": "Here is what I found:\n\n{table}",
+        "empty": "I couldn't find any rows matching that.",
+    }
+
+    def __init__(self, shapes=("scalar", "table", "empty"), max_rows=5, max_columns=3, templates=None):
+        self.shapes = set(shapes)
+        self.max_rows = max_rows
+        self.max_columns = max_columns
+        self.templates = dict(self.DEFAULT_TEMPLATES, **(templates or {}))
+        self.answered = 0
+
+    @staticmethod
+    def _value(value):
+        """
+        The value as is: nothing checks a direct answer afterwards, so text is
+        never cut and numbers keep their precision. Not digit-grouped either,
+        as a lone number is as often a year or a TaskID as a count.
+        """
+        if value is None:
+            return "none"
+        if isinstance(value, float) and not value.is_integer():
+            return f"{value:.15g}"
+        if _is_number(value):
+            return _number(value, grouped=False)
+        return str(value).replace("|", "\\|").replace("\n", " ")
+
+    def shape(self, columns, rows):
+        if not rows:
+            return "empty"
+        if len(rows) == 1 and len(columns) == 1:
+            return "scalar"
+        if len(rows) <= self.max_rows and len(columns) <= self.max_columns:
+            return "table"
+        return None
+
+    def render(self, columns, rows):
+        """The answer text, or None when the result needs the summarizer. `rows` should hold uncut values."""
+        shape = self.shape(columns, rows)
+        if shape not in self.shapes:
+            return None
+
+        if shape == "scalar":
+            return self.templates["scalar"].format(value=self._value(rows[0][0]))
+        if shape == "table":
+            # A cell too long for a table row is left to the summarizer.
+            if any(isinstance(value, str) and len(value) > MAX_CELL_CHARS for row in rows for value in row):
+                return None
+            header = [self._value(column) for column in columns]
+            lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+            lines += ["| " + " | ".join(self._value(value) for value in row) + " |" for row in rows]
+            return self.templates["table"].format(table="\n".join(lines))
+        return self.templates["empty"]
@@ -0,0 +1,88 @@
+import threading
+import time
+
+
+class SyncScheduler:
+    """
+    Coalesces sync requests and never runs more than one sync at a time.
+
+    The first request starts a window of `window` seconds; every request that
+    arrives before it closes joins the same run. A request that arrives while
+    a sync is running schedules exactly one follow-up run, however many
+    requests come in before it starts.
+    """
+
+    def __init__(self, sync_func, window=2.0):
+        self.sync_func = sync_func
+        self.window = window
+        self.requests = 0
+        self.coalesced = 0
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = None
+        self._waiting = 0
+        self._timer = None
+        self._running = False
+        self._rerun = False
+        self._lock = threading.Lock()
+
+    def request(self):
+        """Asks for a sync. Returns immediately; the sync runs on a background thread."""
+        with self._lock:
+            self.requests += 1
+            self._waiting += 1
+            if self._running:
+                if self._rerun:
+                    self.coalesced += 1
+                self._rerun = True
+            elif self._timer is not None:
+                self.coalesced += 1
+            else:
+                self._schedule()
+
+    def _schedule(self):
+        self._timer = threading.Timer(self.window, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+            self._running = True
+            self._waiting = 0
+
+        start = time.perf_counter()
+        try:
+            self.sync_func()
+        except Exception as e:
+            self.failures += 1
+            print(f"❌ Scheduled sync failed: {e}")
+        finally:
+            with self._lock:
+                self._running = False
+                self.runs += 1
+                self.last_duration = round(time.perf_counter() - start, 3)
+                if self._rerun:
+                    self._rerun = False
+                    self._schedule()
+
+    def shutdown(self):
+        """Cancels a sync that has not started yet."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._rerun = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._waiting,
+                "scheduled": self._timer is not None or self._rerun,
+                "running": self._running,
+                "requests": self.requests,
+                "coalesced": self.coalesced,
+                "runs": self.runs,
+                "failures": self.failures,
+                "last_duration": self.last_duration,
+            }
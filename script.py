@@ -1,10 +1,126 @@
 from dotenv import load_dotenv
 import requests
 import sqlite3
+import codecs
+import hashlib
+import json
 import os
+import re
+import time
+from collections import Counter
+from collections.abc import Iterator
+from zoneinfo import ZoneInfoNotFoundError
+
+import dates
+import fulltext
+from index_advisor import IndexAdvisor
+from normalization import ValueNormalizer, ensure_indexes, load_rules
 
 load_dotenv()
 
+# Bumped after every write so readers (the agent's schema cache) know the
+# tables may have changed since they last looked.
+schema_version = 0
+# Bumped by sync_database only when some table's content actually changed,
+# so cached query results stay valid across no-op syncs.
+data_generation = 0
+
+# Incremental sync rewrites only the rows whose content changed. Set
+# SYNC_MODE=full to drop and recreate every table on each sync instead.
+SYNC_MODE = os.getenv("SYNC_MODE", "incremental")
+
+# How long a sync waits for another writer (e.g. an overlapping sync) to finish.
+SYNC_BUSY_TIMEOUT_MS = int(os.getenv("SYNC_BUSY_TIMEOUT_MS", "30000"))
+
+# Set SYNC_INGEST=stream to parse the Apps Script response incrementally and
+# write rows in batches of SYNC_BATCH_ROWS, keeping memory flat for big sheets.
+SYNC_INGEST = os.getenv("SYNC_INGEST", "json")
+SYNC_BATCH_ROWS = int(os.getenv("SYNC_BATCH_ROWS", "5000"))
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Tables longer than this are classified on a sample before the full
+# type-inference pass.
+TYPE_INFERENCE_SAMPLE_ROWS = int(os.getenv("TYPE_INFERENCE_SAMPLE_ROWS", "20000"))
+
+# Each sync creates indexes for the columns the agent's recorded queries
+# filter, join and sort on (see index_advisor); INDEX_ADVISOR=0 turns it off.
+INDEX_ADVISOR = os.getenv("INDEX_ADVISOR", "1") == "1"
+index_advisor = IndexAdvisor(
+    os.getenv("INDEX_ADVISOR_DB", "workload.db"),
+    min_queries=int(os.getenv("INDEX_ADVISOR_MIN_QUERIES", "2")),
+    max_per_table=int(os.getenv("INDEX_ADVISOR_MAX_PER_TABLE", "4")),
+)
+
+# TEXT columns whose values average at least FULLTEXT_MIN_CHARS characters
+# get an FTS5 index, `<table>_fts` (see fulltext); FULLTEXT_INDEX=0 turns it off.
+FULLTEXT_INDEX = os.getenv("FULLTEXT_INDEX", "1") == "1"
+FULLTEXT_MIN_CHARS = int(os.getenv("FULLTEXT_MIN_CHARS", "32"))
+
+# Columns with a rule in NORMALIZATION_RULES (a JSON file; the built-in rules
+# cover Status, Priority and Assignee) get an indexed `<column>_canonical`
+# companion (see normalization); VALUE_NORMALIZATION=0 turns it off.
+VALUE_NORMALIZATION = os.getenv("VALUE_NORMALIZATION", "1") == "1"
+value_normalizer = ValueNormalizer(load_rules(os.getenv("NORMALIZATION_RULES")) if VALUE_NORMALIZATION else {})
+
+# Row hashes of every table as last written, keyed by (db_name, table):
+# {row hash: [rowids of the stored rows with that content]}.
+_row_hashes = {}
+
+# A payload entry under this name is not a sheet but metadata about the
+# spreadsheet, `{"timeZone": "Asia/Kolkata"}`; Apps Script should send it
+# first, so a streamed sync sees it before any sheet (see the README).
+PAYLOAD_METADATA_KEY = "_meta"
+
+# Per-table counts from the most recent write_to_sqlite call.
+last_write_stats = {}
+# Sheets the most recent write_to_sqlite call skipped because their content
+# fingerprint matched the last write.
+last_skipped_sheets = []
+
+# Fingerprint of each sheet's JSON as last written, keyed by (db_name, sheet),
+# with the table it was written to.
+_sheet_fingerprints = {}
+# ETag and fingerprint of the last payload sync_database applied.
+_last_payload = {"etag": None, "fingerprint": None, "sheets": 0}
+
+# Outcome of the most recent sync_database call and running totals.
+last_sync_report = {}
+sync_totals = Counter()
+
+def _stored_form(value, col_type):
+    """
+    Approximates the value SQLite stores for `value` in a column of `col_type`
+    (type affinity), so a JSON row and the same row read back hash alike.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        value = int(value)
+    if col_type in ("TEXT", *dates.DATE_TYPES):
+        return repr(value) if isinstance(value, float) else str(value)
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                return value
+    if col_type == "REAL" or (isinstance(value, float) and not value.is_integer()):
+        return float(value)
+    return int(value)
+
+def row_hash(values, column_types):
+    """
+    A digest of the row as it is stored. Not `hash()`, which collides on
+    ordinary values (`hash(-1) == hash(-2)`) and would hide such an edit.
+    """
+    stored = tuple(_stored_form(v, t) for v, t in zip(values, column_types))
+    return hashlib.blake2b(repr(stored).encode(), digest_size=16).hexdigest()
+
+def fingerprint(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
 def fetch_data_from_sheet(url):
     """Fetches and parses JSON data from the Google Apps Script URL."""
     try:
@@ -17,52 +133,749 @@ def fetch_data_from_sheet(url):
         print(f"❌ Error fetching data: {e}")
         return None
 
+def fetch_payload(url, etag=None, stream=False):
+    """
+    Requests the Apps Script payload, with If-None-Match when `etag` (from an
+    earlier response) is given. Returns the response, or None when the
+    source answered 304 Not Modified. Apps Script itself sends no ETag, so
+    this only helps behind a proxy or cache that does.
+    """
+    headers = {"If-None-Match": etag} if etag else {}
+    response = requests.get(url, headers=headers, stream=stream)
+    response.raise_for_status()
+    if response.status_code == 304:
+        response.close()
+        return None
+    return response
+
+_JSON_WHITESPACE = re.compile(r"\s*")
+
+def parse_payload(text):
+    """
+    Parses the payload, `{"Sheet": [...], ...}`, into `(data, fingerprints)`:
+    the sheets as `json.loads` would return them, and a fingerprint of each
+    sheet's raw JSON text, so a sheet can be skipped without re-serializing it.
+    """
+    decoder = json.JSONDecoder()
+    data, fingerprints = {}, {}
+
+    pos = _JSON_WHITESPACE.match(text).end()
+    if text[pos:pos + 1] != "{":
+        raise ValueError("The payload is not a JSON object.")
+    pos = _JSON_WHITESPACE.match(text, pos + 1).end()
+    if text[pos:pos + 1] == "}":
+        return data, fingerprints
+    while True:
+        name, pos = decoder.raw_decode(text, pos)
+        pos = _JSON_WHITESPACE.match(text, pos).end()
+        if text[pos:pos + 1] != ":":
+            raise ValueError(f"Expected ':' at position {pos} of the payload.")
+        start = _JSON_WHITESPACE.match(text, pos + 1).end()
+        data[name], pos = decoder.raw_decode(text, start)
+        fingerprints[name] = fingerprint(text[start:pos].encode("utf-8", "surrogatepass"))
+        pos = _JSON_WHITESPACE.match(text, pos).end()
+        if text[pos:pos + 1] == "}":
+            return data, fingerprints
+        if text[pos:pos + 1] != ",":
+            raise ValueError(f"Expected ',' or '}}' at position {pos} of the payload.")
+        pos = _JSON_WHITESPACE.match(text, pos + 1).end()
+
+class JSONSheetStream:
+    """
+    Incrementally parses the Apps Script payload, `{"Sheet": [{...}, ...], ...}`,
+    from an iterable of text chunks. Iterating yields `(sheet_name, rows)` pairs
+    where `rows` is a lazy iterator over that sheet's row objects; it must be
+    consumed before moving on to the next sheet. Entries that are not arrays,
+    like PAYLOAD_METADATA_KEY, are yielded with their decoded value. Only the
+    unparsed tail of the current chunk and the row being decoded are held in
+    memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = ""
+        self._pos = 0
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Skips whitespace and returns the next character ('' at the end of the input)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def _consume(self, expected):
+        char = self._peek()
+        if not char or char not in expected:
+            raise ValueError(f"Malformed sheet payload: expected one of {expected!r}, got {char!r}")
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decodes the next JSON value, reading more input until it is complete."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number that ends exactly at the end of the buffer may continue in the next chunk.
+            if end == len(self._buf) and isinstance(value, (int, float)) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _rows(self):
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._consume(",]") == "]":
+                return
+
+    def __iter__(self):
+        self._consume("{")
+        if self._peek() == "}":
+            return
+        while True:
+            name = self._value()
+            self._consume(":")
+            if self._peek() == "[":
+                self._pos += 1
+                rows = self._rows()
+                yield name, rows
+                for _ in rows:  # skip whatever the consumer left unread
+                    pass
+            else:
+                yield name, self._value()
+            if self._consume(",}") == "}":
+                return
+
+def stream_data_from_sheet(url):
+    """
+    Streams the Apps Script payload instead of loading it with `response.json()`,
+    yielding `(sheet_name, rows)` pairs as `JSONSheetStream` does.
+    """
+    print("➡️ Streaming data from URL...")
+    yield from stream_sheets(fetch_payload(url, stream=True))
+
+def stream_sheets(response):
+    """Yields `(sheet_name, rows)` pairs from a streaming response, closing it at the end."""
+    with response:
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+        chunks = (decoder.decode(chunk) for chunk in response.iter_content(chunk_size=STREAM_CHUNK_BYTES))
+        yield from JSONSheetStream(chunks)
+
+INTEGER, REAL, TEXT = 0, 1, 2
+TYPE_ORDER = ["INTEGER", "REAL", "TEXT"]
+
+def _classify_value(value):
+    """Returns INTEGER, REAL or TEXT for one cell, or None for an empty cell."""
+    value_type = type(value)
+    if value_type is int:
+        return INTEGER
+    if value_type is float:
+        return REAL
+
+    value = str(value)
+    if value == '':
+        return None # Skip empty values in type detection
+    if value.isdigit() or (value.startswith('-') and value[1:].isdigit()):
+        return INTEGER
+    try:
+        float(value)
+        return REAL
+    except ValueError:
+        return TEXT
+
+def _widen_kinds(rows, columns, kinds):
+    """
+    Single pass over `rows` that widens every column's kind at once. Columns
+    drop out as soon as they reach TEXT, and the pass stops when none are left.
+    The common cells (JSON numbers, empty and digit-only strings) are decided
+    inline; everything else goes through `_classify_value`.
+    """
+    open_columns = [(i, col) for i, col in enumerate(columns) if kinds[i] < TEXT]
+    for row in rows:
+        if not open_columns:
+            break
+        reached_text = False
+        for i, col in open_columns:
+            value = row.get(col, '')
+            value_type = type(value)
+            if value_type is int:
+                continue
+            if value_type is float:
+                kind = REAL
+            elif value_type is str and (value == '' or value.isdigit()):
+                continue
+            else:
+                kind = _classify_value(value)
+            if kind is not None and kind > kinds[i]:
+                kinds[i] = kind
+                reached_text = reached_text or kind == TEXT
+        if reached_text:
+            open_columns = [(i, col) for i, col in open_columns if kinds[i] < TEXT]
+    return kinds
+
 def infer_column_types(rows):
-    """Infers data types (INTEGER, REAL, TEXT) for each column, ignoring empty column names."""
+    """
+    Infers data types (INTEGER, REAL, TEXT, DATE, DATETIME) for each column, ignoring empty column names.
+
+    All columns are classified together in one pass over the rows. Tables
+    larger than TYPE_INFERENCE_SAMPLE_ROWS are first classified on an evenly
+    spaced sample, which finds the TEXT columns early; the full pass then
+    only verifies the columns that still look numeric. TEXT columns whose
+    values all parse as dates become DATE or DATETIME (see dates).
+    """
     if not rows:
         return {}
         
-    column_types = {}
     # Filter out any column names that are empty strings
     columns = [col for col in rows[0].keys() if col]
+    kinds = [INTEGER] * len(columns)
+
+    if len(rows) > TYPE_INFERENCE_SAMPLE_ROWS:
+        step = len(rows) // TYPE_INFERENCE_SAMPLE_ROWS
+        kinds = _widen_kinds(rows[::step], columns, kinds)
+
+    kinds = _widen_kinds(rows, columns, kinds)
+
+    column_types = {col: TYPE_ORDER[kind] for col, kind in zip(columns, kinds)}
+    for col, col_type in column_types.items():
+        if col_type == "TEXT":
+            # Stops at the first value that is not a date, so ordinary text costs one parse.
+            column_types[col] = dates.detect(row.get(col, '') for row in rows) or "TEXT"
+    return column_types
+
+def _merge_types(a, b):
+    if a == b:
+        return a
+    if a in dates.DATE_TYPES and b in dates.DATE_TYPES:
+        return dates.DATETIME
+    if a in dates.DATE_TYPES or b in dates.DATE_TYPES:
+        return "TEXT"
+    return max(a, b, key=TYPE_ORDER.index)
+
+def _blank_columns(rows, columns):
+    """The columns that are empty in every one of `rows`, so their inferred type means nothing."""
+    return {col for col in columns if all(row.get(col) in (None, '') for row in rows)}
+
+def merge_column_types(a, b):
+    """Combines types inferred from two batches of the same table; the wider type wins."""
+    return {col: _merge_types(a.get(col, "INTEGER"), b.get(col, "INTEGER")) for col in {**a, **b}}
+
+def _convert_dates(values, column_types):
+    """Rewrites the cells of DATE and DATETIME columns as ISO-8601 text."""
+    date_columns = [(i, col_type) for i, col_type in enumerate(column_types.values()) if col_type in dates.DATE_TYPES]
+    if not date_columns:
+        return values
+    converted = []
+    for row in values:
+        row = list(row)
+        for i, col_type in date_columns:
+            row[i] = dates.to_iso(row[i], col_type)
+        converted.append(tuple(row))
+    return converted
+
+def _record_date_cells(cursor, rowids, originals, values, column_types):
+    """
+    Keeps the original text of the cells `_convert_dates` rewrote, with the
+    type they were converted for, in the TEMP table `date_cells`, so
+    `_restore_date_cells` can redo them if a later batch widens the column.
+    """
+    date_columns = [(i, col_type) for i, col_type in enumerate(column_types.values()) if col_type in dates.DATE_TYPES]
+    cursor.executemany("INSERT INTO temp.date_cells VALUES (?, ?, ?, ?)", [
+        (rowid, i, col_type, original[i])
+        for rowid, original, row in zip(rowids, originals, values)
+        for i, col_type in date_columns
+        if original[i] != row[i]
+    ])
+
+def _restore_date_cells(cursor, table_name, column_types):
+    """
+    Converts the recorded date cells again for their column's final type:
+    DATETIME for a DATE column that later batches widened, and the original
+    text for one that became TEXT (or, blank until then, a number type). A streamed sheet then ends up stored as
+    `_write_table` would store it. Returns the number of cells rewritten.
+    """
+    rewritten = 0
+    for i, (col, col_type) in enumerate(column_types.items()):
+        cells = cursor.connection.execute(
+            "SELECT cell_rowid, original FROM temp.date_cells WHERE col = ? AND kind != ?", (i, col_type)
+        )
+        for batch in _batched(cells, SYNC_BATCH_ROWS):
+            cursor.executemany(f"UPDATE {_quote(table_name)} SET {_quote(col)} = ? WHERE rowid = ?", [
+                (original if col_type not in dates.DATE_TYPES else dates.to_iso(original, col_type), rowid)
+                for rowid, original in batch
+            ])
+            rewritten += len(batch)
+    return rewritten
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _with_companions(column_types, companions):
+    """Appends the canonical companion columns (always TEXT) to inferred column types."""
+    return {**column_types, **{companion: "TEXT" for _, _, companion in companions}}
+
+def _existing_column_types(cursor, table_name):
+    """Column name -> declared type of an existing table, in column order ({} if it does not exist)."""
+    return {name: col_type for _, name, col_type, *_ in cursor.execute(f"PRAGMA table_info({_quote(table_name)})")}
+
+def _stored_row_hashes(cursor, table_name, column_types):
+    """`{row hash: [rowid, ...]}` for the rows stored in `table_name`."""
+    quoted_columns = ", ".join(_quote(c) for c in column_types)
+    types = list(column_types.values())
+    hashes = {}
+    for rowid, *values in cursor.execute(f"SELECT rowid, {quoted_columns} FROM {_quote(table_name)}"):
+        hashes.setdefault(row_hash(values, types), []).append(rowid)
+    return hashes
+
+def _hash_map(hashes, first_rowid=1):
+    """`{row hash: [rowid, ...]}` for rows inserted with rowid = their position."""
+    rowids = {}
+    for rowid, h in enumerate(hashes, start=first_rowid):
+        rowids.setdefault(h, []).append(rowid)
+    return rowids
+
+def _create_table(cursor, table_name, column_types):
+    column_definitions = ", ".join([f'{_quote(col)} {col_type}' for col, col_type in column_types.items()])
+
+    cursor.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+    cursor.execute(f"CREATE TABLE {_quote(table_name)} ({column_definitions})")
+    print(f"Table '{table_name}' created.")
+
+def _insert_rows(cursor, table_name, columns, values, first_rowid=1):
+    """Inserts rows with consecutive rowids from `first_rowid` (their sheet position when the table is new)."""
+    placeholders = ", ".join(["?"] * (len(columns) + 1))
+    quoted_columns = ", ".join(_quote(c) for c in columns)
+    insert_sql = f"INSERT INTO {_quote(table_name)} (rowid, {quoted_columns}) VALUES ({placeholders})"
+    cursor.executemany(insert_sql, ((i, *row) for i, row in enumerate(values, start=first_rowid)))
+
+def _retype_table(cursor, table_name, column_types):
+    """Changes declared column types by copying the rows into a table created with the new types."""
+    staging = f"{table_name}__retype"
+    quoted_columns = ", ".join(_quote(c) for c in column_types)
+    _create_table(cursor, staging, column_types)
+    cursor.execute(f"INSERT INTO {_quote(staging)} (rowid, {quoted_columns}) SELECT rowid, {quoted_columns} FROM {_quote(table_name)}")
+    cursor.execute(f"DROP TABLE {_quote(table_name)}")
+    cursor.execute(f"ALTER TABLE {_quote(staging)} RENAME TO {_quote(table_name)}")
+    print(f"Column types of '{table_name}' changed to {column_types}.")
+
+def _apply_row_delta(cursor, table_name, columns, old_hashes, new_hashes, values):
+    """
+    Writes the difference between the stored rows, `old_hashes` as returned
+    by `_stored_row_hashes`, and the sheet's rows. Rows are matched by content
+    hash, not position, so inserting or deleting a row anywhere in the sheet
+    writes only that row and unchanged rows keep their rowid. Stored rows left
+    without a match are reused for the sheet rows without one (an edited row
+    becomes one UPDATE) and the rest are deleted; new rows get fresh rowids.
+    Returns the stats and the new `{row hash: [rowid, ...]}` map.
+    """
+    quoted_table = _quote(table_name)
+    row_hashes, unmatched, used = {}, [], Counter()
+    for i, new_hash in enumerate(new_hashes):
+        rowids = old_hashes.get(new_hash)
+        if rowids is None or used[new_hash] == len(rowids):
+            unmatched.append(i)
+            continue
+        row_hashes.setdefault(new_hash, []).append(rowids[used[new_hash]])
+        used[new_hash] += 1
+
+    free = sorted(rowid for old_hash, rowids in old_hashes.items() for rowid in rowids[used[old_hash]:])
+    first_new_rowid = max((max(rowids) for rowids in old_hashes.values()), default=0) + 1
+    updates, inserts = [], []
+    for n, i in enumerate(unmatched):
+        if n < len(free):
+            rowid = free[n]
+            updates.append((*values[i], rowid))
+        else:
+            rowid = first_new_rowid + len(inserts)
+            inserts.append(values[i])
+        row_hashes.setdefault(new_hashes[i], []).append(rowid)
+    deletes = [(rowid,) for rowid in free[len(unmatched):]]
+
+    if deletes:
+        cursor.executemany(f"DELETE FROM {quoted_table} WHERE rowid = ?", deletes)
+    if updates:
+        assignments = ", ".join(f"{_quote(c)} = ?" for c in columns)
+        cursor.executemany(f"UPDATE {quoted_table} SET {assignments} WHERE rowid = ?", updates)
+    if inserts:
+        _insert_rows(cursor, table_name, columns, inserts, first_new_rowid)
+    return {"inserted": len(inserts), "updated": len(updates), "deleted": len(deletes)}, row_hashes
+
+def _stage_stored_hashes(cursor, table_name, column_types):
+    """
+    Streaming counterpart of `_stored_row_hashes`: hashes the stored rows into
+    the TEMP table `stored_rows`, indexed on the hash, so matching a batch
+    does not need every hash in memory. Returns the largest stored rowid.
+    """
+    cursor.execute("DROP TABLE IF EXISTS temp.stored_rows")
+    cursor.execute("CREATE TEMP TABLE stored_rows (stored_rowid INTEGER PRIMARY KEY, hash TEXT)")
+    quoted_columns = ", ".join(_quote(c) for c in column_types)
+    types = list(column_types.values())
+    stored = cursor.connection.execute(f"SELECT rowid, {quoted_columns} FROM {_quote(table_name)}")
+    for batch in _batched(stored, SYNC_BATCH_ROWS):
+        cursor.executemany("INSERT INTO temp.stored_rows VALUES (?, ?)", [(rowid, row_hash(values, types)) for rowid, *values in batch])
+    cursor.execute("CREATE INDEX temp.stored_rows_hash ON stored_rows (hash)")
+    return cursor.execute("SELECT COALESCE(MAX(stored_rowid), 0) FROM temp.stored_rows").fetchone()[0]
+
+def _claim_stored_rows(cursor, hashes):
+    """
+    Takes a staged stored row with the same content for each of `hashes`, and
+    returns their rowids (None where there is none). Claimed rows leave
+    `stored_rows`, so what is left at the end has no match in the sheet.
+    """
+    found = {}
+    for stored_hash, rowid in cursor.execute(
+        "SELECT hash, stored_rowid FROM temp.stored_rows WHERE hash IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(set(hashes))),),
+    ):
+        found.setdefault(stored_hash, []).append(rowid)
+    rowids = [found[h].pop() if found.get(h) else None for h in hashes]
+    cursor.executemany("DELETE FROM temp.stored_rows WHERE stored_rowid = ?", [(rowid,) for rowid in rowids if rowid is not None])
+    return rowids
+
+def _sanitized_columns(table_name, first_row):
+    """Returns the table's SQL name and non-empty column names, or None if the sheet cannot be stored."""
+    # Filter out any column names that are empty strings
+    columns = [col for col in first_row.keys() if col]
+
+    # If after filtering there are no columns, skip this table
+    if not columns:
+        print(f"⚠️ Skipping table '{table_name}' as it has no valid column headers.")
+        return None
+
+    return "".join(c for c in table_name if c.isalnum()), columns
+
+def _write_table(cursor, db_name, table_name, rows, incremental):
+    """Writes a fully loaded sheet. Returns (table, stats), or None if it was skipped."""
+    if not rows:
+        print(f"⚠️ Skipping empty sheet: {table_name}")
+        return None
+
+    sanitized = _sanitized_columns(table_name, rows[0])
+    if sanitized is None:
+        return None
+    sanitized_table_name, columns = sanitized
+    companions = value_normalizer.companions(columns)
     
-    for col in columns:
-        is_integer = True
-        is_real = True
-        
-        for row in rows:
-            value = str(row.get(col, ''))
-            if value is None or value == '':
-                continue # Skip empty values in type detection
+    # Infer data types for this table
+    column_types = _with_companions(infer_column_types(rows), companions)
+    print(f"Inferred types for '{sanitized_table_name}': {column_types}")
 
-            # Check for INTEGER
-            if is_integer and not (value.isdigit() or (value.startswith('-') and value[1:].isdigit())):
-                is_integer = False
+    # Extract only the values for the valid columns, plus their canonical companions
+    values = value_normalizer.extend([tuple(row.get(col, None) for col in columns) for row in rows], companions)
+    values = _convert_dates(values, column_types)
+    columns = list(column_types)
+    types = list(column_types.values())
+    new_hashes = [row_hash(row, types) for row in values]
 
-            # Check for REAL (if not an integer)
-            if is_real and not is_integer:
-                try:
-                    float(value)
-                except ValueError:
-                    is_real = False
-            
-            # If it's not a number, it must be TEXT
-            if not is_integer and not is_real:
-                break # Optimization: once it's TEXT, it stays TEXT
-        
-        if is_integer:
-            column_types[col] = "INTEGER"
-        elif is_real:
-            column_types[col] = "REAL"
+    key = (db_name, sanitized_table_name)
+    old_hashes = None
+    if incremental and list(_existing_column_types(cursor, sanitized_table_name).items()) == list(column_types.items()):
+        old_hashes = _row_hashes.get(key)
+        if old_hashes is None:
+            old_hashes = _stored_row_hashes(cursor, sanitized_table_name, column_types)
+
+    if old_hashes is None:
+        _create_table(cursor, sanitized_table_name, column_types)
+        _insert_rows(cursor, sanitized_table_name, columns, values)
+        print(f"Inserted {len(values)} rows into '{sanitized_table_name}'.")
+        stats = {"inserted": len(values), "updated": 0, "deleted": 0, "rebuilt": True}
+        row_hashes = _hash_map(new_hashes)
+    else:
+        stats, row_hashes = _apply_row_delta(cursor, sanitized_table_name, columns, old_hashes, new_hashes, values)
+        stats["rebuilt"] = False
+        print(f"Applied delta to '{sanitized_table_name}': {stats['inserted']} inserted, {stats['updated']} updated, {stats['deleted']} deleted.")
+
+    _row_hashes[key] = row_hashes
+    return sanitized_table_name, stats
+
+def _write_table_batches(cursor, db_name, table_name, rows, incremental):
+    """
+    Streaming counterpart of `_write_table`: consumes `rows` in batches of
+    SYNC_BATCH_ROWS and matches each batch by content hash against the stored
+    rows, staged in a TEMP table (see `_stage_stored_hashes`), so memory does
+    not grow with the sheet. Unmatched rows are inserted and unclaimed stored
+    rows deleted at the end, so an edited row counts as one of each. Column
+    types are merged across batches, and the table is retyped at the end if
+    the final types differ from the declared ones.
+    """
+    batches = _batched(rows, SYNC_BATCH_ROWS)
+    first_batch = next(batches, None)
+    if not first_batch:
+        print(f"⚠️ Skipping empty sheet: {table_name}")
+        return None
+
+    sanitized = _sanitized_columns(table_name, first_batch[0])
+    if sanitized is None:
+        for _ in batches:
+            pass
+        return None
+    sanitized_table_name, source_columns = sanitized
+    companions = value_normalizer.companions(source_columns)
+
+    column_types = _with_companions(infer_column_types(first_batch), companions)
+    columns = list(column_types)
+    declared_types = _existing_column_types(cursor, sanitized_table_name)
+    diff = incremental and list(declared_types) == columns
+    if not diff:
+        _create_table(cursor, sanitized_table_name, column_types)
+        declared_types = column_types
+
+    stats = {"inserted": 0, "updated": 0, "deleted": 0, "rebuilt": not diff}
+    written = 0
+    # Columns blank in every batch so far are untyped: the first batch that
+    # has values decides their type. `typed_late` are those decided after
+    # some of their blank cells were already written.
+    blank, typed_late = _blank_columns(first_batch, source_columns), set()
+    if diff:
+        # Until then they keep their stored type, so their rows hash as stored.
+        column_types = {**column_types, **{col: declared_types[col] for col in blank}}
+    # Names seen so far in username columns; the stored ones are known up front,
+    # so rows written earlier keep the form they were stored with.
+    names = {}
+    cursor.execute("DROP TABLE IF EXISTS temp.date_cells")
+    cursor.execute("CREATE TEMP TABLE date_cells (cell_rowid INTEGER, col INTEGER, kind TEXT, original)")
+    if diff:
+        next_rowid = _stage_stored_hashes(cursor, sanitized_table_name, declared_types) + 1
+        for _, column, _ in companions:
+            stored = cursor.execute(f"SELECT DISTINCT {_quote(column)} FROM {_quote(sanitized_table_name)}")
+            value_normalizer.learn(names, column, (value for (value,) in stored))
+    batch = first_batch
+    while batch:
+        if batch is not first_batch:
+            batch_types = infer_column_types(batch)
+            batch_blank = _blank_columns(batch, source_columns)
+            for col in batch_blank:
+                batch_types[col] = column_types[col]
+            newly_typed = blank - batch_blank
+            typed_late |= newly_typed
+            blank &= batch_blank
+            column_types = merge_column_types({**column_types, **{col: batch_types[col] for col in newly_typed}}, batch_types)
+        originals = value_normalizer.extend([tuple(row.get(col, None) for col in source_columns) for row in batch], companions, names)
+        values = _convert_dates(originals, column_types)
+
+        if diff:
+            new_hashes = [row_hash(v, list(declared_types.values())) for v in values]
+            rowids = _claim_stored_rows(cursor, new_hashes)
+            inserts = [row for row, rowid in zip(values, rowids) if rowid is None]
+            _insert_rows(cursor, sanitized_table_name, columns, inserts, next_rowid)
+            for i in (i for i, rowid in enumerate(rowids) if rowid is None):
+                rowids[i] = next_rowid
+                next_rowid += 1
+            stats["inserted"] += len(inserts)
         else:
-            column_types[col] = "TEXT"
-            
-    return column_types
+            rowids = range(written + 1, written + len(values) + 1)
+            _insert_rows(cursor, sanitized_table_name, columns, values, written + 1)
+            stats["inserted"] += len(values)
+        if values is not originals:
+            _record_date_cells(cursor, rowids, originals, values, column_types)
+
+        written += len(values)
+        batch = next(batches, None)
+
+    if diff:
+        # Stored rows no batch claimed are gone from the sheet.
+        cursor.execute(f"DELETE FROM {_quote(sanitized_table_name)} WHERE rowid IN (SELECT stored_rowid FROM temp.stored_rows)")
+        stats["deleted"] = cursor.rowcount
+        cursor.execute("DROP TABLE temp.stored_rows")
+    stats["updated"] += value_normalizer.rewrite_ambiguous(cursor, sanitized_table_name, companions, names)
+    if _restore_date_cells(cursor, sanitized_table_name, column_types):
+        print(f"Date cells of '{sanitized_table_name}' converted again for the widened column types.")
+    for col in typed_late:
+        if column_types[col] in dates.DATE_TYPES:
+            # Written as '' before the column turned out to hold dates; `_convert_dates` makes them NULL.
+            cursor.execute(f"UPDATE {_quote(sanitized_table_name)} SET {_quote(col)} = NULL WHERE {_quote(col)} = ''")
+    cursor.execute("DROP TABLE temp.date_cells")
+    if list(column_types.items()) != list(declared_types.items()):
+        _retype_table(cursor, sanitized_table_name, column_types)
+        stats["rebuilt"] = True
+
+    print(f"Streamed {written} rows into '{sanitized_table_name}' ({column_types}): "
+          f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['deleted']} deleted.")
+    # Hashes of a streamed table are not kept; the next sync reads them back from the table.
+    _row_hashes.pop((db_name, sanitized_table_name), None)
+    return sanitized_table_name, stats
+
+def _apply_metadata(metadata):
+    """Applies the payload's PAYLOAD_METADATA_KEY entry: the spreadsheet's timezone, for dates."""
+    name = metadata.get("timeZone") if isinstance(metadata, dict) else None
+    try:
+        changed = dates.set_timezone(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"⚠️ Unknown sheet timezone {name!r}; falling back to SHEET_TIMEZONE.")
+        changed = dates.set_timezone(None)
+    if changed:
+        print(f"Sheet timezone is now {name or 'SHEET_TIMEZONE'}.")
+        # Sheets whose JSON did not change may still store different dates now.
+        _sheet_fingerprints.clear()
+
+def _without_metadata(sheets):
+    """Applies the payload's metadata entry as it goes by and yields the sheets."""
+    for name, rows in sheets:
+        if name == PAYLOAD_METADATA_KEY:
+            _apply_metadata(rows)
+        elif not isinstance(rows, (list, Iterator)):
+            print(f"⚠️ Skipping '{name}': not a sheet.")
+        else:
+            yield name, rows
+
+def _unchanged_sheet(cursor, db_name, sheet_name, sheet_fingerprint):
+    """True when the sheet was last written with this fingerprint and its table is still there."""
+    written = _sheet_fingerprints.get((db_name, sheet_name))
+    if sheet_fingerprint is None or written is None or written[0] != sheet_fingerprint:
+        return False
+    return bool(_existing_column_types(cursor, written[1]))
+
+def _write_sheets(sheets, db_name, mode, fingerprints=None):
+    """
+    Writes `(sheet_name, rows)` pairs in one transaction and returns the
+    tables whose content changed. In incremental mode, sheets whose entry in
+    `fingerprints` matches the last write are skipped without touching their
+    table, and when every sheet is skipped no transaction is opened at all.
+    """
+    global schema_version
+
+    incremental = (mode or SYNC_MODE) == "incremental"
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    cursor = conn.cursor()
+    # WAL lets readers keep querying the last committed snapshot while the
+    # sync transaction is open; the mode is persistent, so this is a no-op
+    # after the first sync.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout = {SYNC_BUSY_TIMEOUT_MS}")
+    print(f"✅ Connected to SQLite database '{db_name}'")
+    changed_tables = []
+    schema_changed = False
+    last_write_stats.clear()
+    last_skipped_sheets.clear()
+    written_fingerprints = {}
+
+    try:
+        if fingerprints and incremental:
+            pending = []
+            for sheet_name, rows in sheets:
+                if _unchanged_sheet(cursor, db_name, sheet_name, fingerprints.get(sheet_name)):
+                    last_skipped_sheets.append(sheet_name)
+                else:
+                    pending.append((sheet_name, rows))
+            sheets = pending
+            if last_skipped_sheets:
+                print(f"⏭️ Skipping unchanged sheets: {last_skipped_sheets}")
+            if not sheets:
+                print("✅ No sheet changed; nothing written.")
+                return []
+
+        cursor.execute("BEGIN IMMEDIATE")
+        for table_name, rows in sheets:
+            write_table = _write_table if isinstance(rows, list) else _write_table_batches
+            written = write_table(cursor, db_name, table_name, rows, incremental)
+            if written is None:
+                continue
+
+            sanitized_table_name, stats = written
+            if fingerprints and table_name in fingerprints:
+                written_fingerprints[(db_name, table_name)] = (fingerprints[table_name], sanitized_table_name)
+            last_write_stats[sanitized_table_name] = stats
+            schema_changed = schema_changed or stats["rebuilt"]
+            if stats["rebuilt"] or stats["inserted"] or stats["updated"] or stats["deleted"]:
+                changed_tables.append(sanitized_table_name)
+
+        for table_name in last_write_stats:
+            # Recreated tables lost their indexes; existing ones are left alone.
+            ensure_indexes(cursor, table_name)
+            dates.ensure_indexes(cursor, table_name)
+
+        if FULLTEXT_INDEX:
+            for table_name, stats in last_write_stats.items():
+                changed = table_name in changed_tables
+                cursor.execute("SAVEPOINT fulltext")
+                try:
+                    if fulltext.sync_fulltext(cursor, table_name, stats["rebuilt"], changed, FULLTEXT_MIN_CHARS):
+                        schema_changed = True
+                    cursor.execute("RELEASE fulltext")
+                except sqlite3.OperationalError as e:
+                    # e.g. a SQLite build without FTS5; LIKE still works, only slower.
+                    cursor.execute("ROLLBACK TO fulltext")
+                    cursor.execute("RELEASE fulltext")
+                    print(f"⚠️ Full-text index for '{table_name}' skipped: {e}")
 
-def write_to_sqlite(data, db_name='database.db'):
+        if INDEX_ADVISOR:
+            cursor.execute("SAVEPOINT index_advisor")
+            try:
+                report = index_advisor.apply(cursor, tables_changed=bool(changed_tables))
+                cursor.execute("RELEASE index_advisor")
+                if report["created"] or report["dropped"]:
+                    print(f"✅ Index advisor created {report['created']} and dropped {report['dropped']}.")
+            except Exception as e:
+                # Indexes only speed reads up; a failure here must not lose the
+                # sync, nor leave half of its index changes in it.
+                cursor.execute("ROLLBACK TO index_advisor")
+                cursor.execute("RELEASE index_advisor")
+                print(f"❌ Index advisor failed: {e}")
+
+        cursor.execute("COMMIT")
+        # Copies committed pages back into the database file without waiting;
+        # pages an in-flight reader still needs are kept until it finishes.
+        cursor.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    except Exception:
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        for table_name in last_write_stats:
+            _row_hashes.pop((db_name, table_name), None)
+        raise
+    finally:
+        conn.close()
+
+    _sheet_fingerprints.update(written_fingerprints)
+    if schema_changed:
+        schema_version += 1
+    print(f"✅ Database write complete and connection closed (schema version {schema_version}).")
+    return changed_tables
+
+def write_to_sqlite(data, db_name='database.db', mode=None, fingerprints=None):
     """
     Writes the fetched data into an SQLite database with inferred types, 
     ignoring any columns with empty string names.
+
+    In incremental mode (the default, see SYNC_MODE) each row is hashed and
+    matched with a stored row of the same content wherever it is in the
+    sheet, and only inserted, updated and deleted rows are written, so adding
+    or removing a row in the middle of a sheet writes just that row. Rowids
+    therefore stay with their rows rather than follow sheet order. A table is rebuilt only when its
+    columns or inferred types change.
+
+    All tables are written in a single transaction on a WAL-mode database, so
+    concurrent readers never block and never see a half-synced table: they
+    keep reading the previous snapshot until the commit, and the next query
+    sees the new one. If anything fails the whole sync is rolled back.
     
     SQLite does not have a storage class set aside for storing dates and/or times. 
     Instead, the built-in Date And Time Functions of SQLite are capable of 
@@ -71,60 +884,45 @@ def write_to_sqlite(data, db_name='database.db'):
     TEXT as ISO8601 strings ("YYYY-MM-DD HH:MM:SS.SSS").
     REAL as Julian day numbers.
     INTEGER as Unix Time, the number of seconds since 1970-01-01 00:00:00 UTC.
-    """
-    if not data:
-        print("No data to write.")
-        return
-
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    print(f"✅ Connected to SQLite database '{db_name}'")
 
-    for table_name, rows in data.items():
-        if not rows:
-            print(f"⚠️ Skipping empty sheet: {table_name}")
-            continue
+    Columns detected as dates are declared DATE or DATETIME, stored as
+    ISO8601 TEXT and indexed (see dates), so range filters are index seeks.
 
-        # Filter out any column names that are empty strings
-        columns = [col for col in rows[0].keys() if col]
+    `fingerprints` maps sheet names to a hash of their content (see
+    `parse_payload`); in incremental mode a sheet whose fingerprint is the
+    one it was last written with is skipped, see `last_skipped_sheets`.
 
-        # If after filtering there are no columns, skip this table
-        if not columns:
-            print(f"⚠️ Skipping table '{table_name}' as it has no valid column headers.")
-            continue
+    Returns the names of the tables whose content differs from the last write.
+    """
+    if data and PAYLOAD_METADATA_KEY in data:
+        data = dict(data)
+        _apply_metadata(data.pop(PAYLOAD_METADATA_KEY))
+    if not data:
+        print("No data to write.")
+        return []
 
-        sanitized_table_name = "".join(c for c in table_name if c.isalnum())
-        
-        # Infer data types for this table
-        column_types = infer_column_types(rows)
-        print(f"Inferred types for '{sanitized_table_name}': {column_types}")
+    return _write_sheets(data.items(), db_name, mode, fingerprints)
 
-        # Create the table with correct types and quoted names
-        column_definitions = ", ".join([f'"{col}" {col_type}' for col, col_type in column_types.items()])
-        
-        # Drop table to ensure schema is updated
-        cursor.execute(f"DROP TABLE IF EXISTS {sanitized_table_name}")
-        create_table_sql = f"CREATE TABLE {sanitized_table_name} ({column_definitions})"
-        cursor.execute(create_table_sql)
-        print(f"Table '{sanitized_table_name}' created.")
-
-        # Prepare and execute the insert statements
-        placeholders = ", ".join(["?"] * len(columns))
-        quoted_columns = ", ".join(f'"{c}"' for c in columns)
-        insert_sql = f"INSERT INTO {sanitized_table_name} ({quoted_columns}) VALUES ({placeholders})"
-        
-        # Extract only the values for the valid columns
-        values_to_insert = [tuple(row.get(col, None) for col in columns) for row in rows]
-        
-        cursor.executemany(insert_sql, values_to_insert)
-        print(f"Inserted {len(values_to_insert)} rows into '{sanitized_table_name}'.")
-
-    conn.commit()
-    conn.close()
-    print("✅ Database write complete and connection closed.")
+def write_stream_to_sqlite(sheets, db_name='database.db', mode=None):
+    """
+    Like `write_to_sqlite`, but takes `(sheet_name, rows)` pairs whose rows are
+    iterators (see `stream_data_from_sheet`) and writes them in bounded
+    batches, so the payload never has to fit in memory.
+    """
+    return _write_sheets(_without_metadata(sheets), db_name, mode)
 
 def sync_database():
-    """The main function to orchestrate the fetching and writing process."""
+    """
+    The main function to orchestrate the fetching and writing process.
+
+    In incremental mode, work is skipped at three levels: a 304 answer to
+    If-None-Match (when the source sends ETags), a payload whose fingerprint
+    matches the last one applied, and individual sheets whose fingerprint
+    matches (see `write_to_sqlite`). A skipped sync writes nothing and keeps
+    `data_generation`, so no cached query result is invalidated. The outcome
+    is kept in `last_sync_report` and counted in `sync_totals`.
+    """
+    global data_generation
     APPS_SCRIPT_URL = os.getenv("APPS_SCRIPT_URL")
     
     if not APPS_SCRIPT_URL:
@@ -132,12 +930,63 @@ def sync_database():
         return
         
     print("🚀 Starting database sync process...")
-    sheet_data = fetch_data_from_sheet(APPS_SCRIPT_URL)
-    
-    if sheet_data:
-        write_to_sqlite(sheet_data, 'sheets.db')
-    print("🏁 Database sync process finished.")
+    start = time.perf_counter()
+    db_name = 'sheets.db'
+    # Skipping needs something to compare with: the last payload, written to an existing database.
+    conditional = SYNC_MODE == "incremental" and os.path.exists(db_name)
+    outcome, changed_tables, applied, skipped = "applied", [], 0, 0
+    try:
+        response = fetch_payload(APPS_SCRIPT_URL, _last_payload["etag"] if conditional else None, stream=SYNC_INGEST == "stream")
+        if response is None:
+            outcome, skipped = "not_modified", _last_payload["sheets"]
+            print("✅ Source answered 304 Not Modified; nothing to sync.")
+        elif SYNC_INGEST == "stream":
+            print("➡️ Streaming data from URL...")
+            changed_tables = write_stream_to_sqlite(stream_sheets(response), db_name)
+            applied = len(last_write_stats)
+            _last_payload.update(etag=response.headers.get("ETag"), fingerprint=None, sheets=applied)
+        else:
+            body = response.content
+            payload_fingerprint = fingerprint(body)
+            if conditional and payload_fingerprint == _last_payload["fingerprint"]:
+                outcome, skipped = "unchanged", _last_payload["sheets"]
+                print("✅ Payload unchanged since the last sync; nothing to write.")
+            else:
+                data, fingerprints = parse_payload(body.decode(response.encoding or "utf-8"))
+                print(f"✅ Data fetched successfully! ({len(body):,} bytes, {len(data)} sheets)")
+                changed_tables = write_to_sqlite(data, db_name, fingerprints=fingerprints)
+                applied, skipped = len(last_write_stats), len(last_skipped_sheets)
+                _last_payload["sheets"] = len(data) - (PAYLOAD_METADATA_KEY in data)
+            _last_payload.update(etag=response.headers.get("ETag"), fingerprint=payload_fingerprint)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        outcome = "failed"
+        print(f"❌ Error fetching data, sync rolled back: {e}")
+    except sqlite3.Error as e:
+        # e.g. "database is locked" or a full disk; write_to_sqlite has rolled back.
+        outcome = "failed"
+        print(f"❌ Error writing the database, sync rolled back: {e}")
+    except Exception:
+        outcome = "failed"
+        raise
+    finally:
+        # Recorded even when an unexpected error propagates, so every sync is counted.
+        if changed_tables:
+            data_generation += 1
+            print(f"🔄 Content changed in {changed_tables}, data generation is now {data_generation}.")
+
+        last_sync_report.clear()
+        last_sync_report.update({
+            "outcome": outcome,
+            "sheets_applied": applied,
+            "sheets_skipped": skipped,
+            "tables_changed": changed_tables,
+            "seconds": round(time.perf_counter() - start, 3),
+        })
+        sync_totals.update({"syncs": 1, outcome: 1, "sheets_applied": applied, "sheets_skipped": skipped})
+        print(f"🏁 Database sync process finished: {outcome}, {applied} sheets applied, {skipped} skipped.")
 
+def sync_stats():
+    return {"last": dict(last_sync_report), "totals": dict(sync_totals)}
 
 if __name__ == "__main__":
     sync_database()
\ No newline at end of file
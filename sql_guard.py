@@ -0,0 +1,280 @@
+"""
+Guards around generated SQL: local checks before it reaches the database,
+and limits while it runs.
+
+`validate_sql` applies deterministic fixes for the mistakes the SQL generator
+makes most often and then asks SQLite to compile the statement with EXPLAIN,
+so most broken queries are caught (and many repaired) without executing them
+or paying for another LLM round trip.
+
+`run_limited` executes a query under a wall-clock budget and row/byte caps,
+so a runaway join is stopped instead of pinning a worker.
+"""
+import difflib
+import re
+import sqlite3
+import time
+
+# String literals and quoted identifiers, which the fixes must leave alone.
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])""")
+_NO_SUCH = re.compile(r"no such (table|column): (?:[\w\"]+\.)?\"?(.+?)\"?$")
+
+# Words after which a double-quoted name is an operand, not an alias.
+_KEYWORDS = {
+    "all", "and", "as", "between", "by", "case", "collate", "cross", "distinct", "else", "escape",
+    "except", "exists", "from", "glob", "group", "having", "in", "inner", "intersect", "is", "join",
+    "left", "like", "limit", "match", "natural", "not", "offset", "on", "or", "order", "outer",
+    "over", "partition", "regexp", "select", "then", "union", "using", "when", "where", "with",
+}
+_ALIAS_AFTER = re.compile(r"(?:\bAS|\)|(\w+))\s*$", re.IGNORECASE)
+_CTE_NAME_BEFORE = re.compile(r"^\s*(?:\([^()]*\)\s*)?AS\s*(?:NOT\s+)?(?:MATERIALIZED\s*)?\(", re.IGNORECASE)
+# Names every table has without declaring them; "rank" is the FTS5 relevance column.
+_IMPLICIT_NAMES = {"rowid", "oid", "_rowid_", "rank"}
+
+# How many name repairs to attempt before reporting the error.
+MAX_NAME_FIXES = 3
+
+# SQLite calls the progress handler every this many VM instructions.
+PROGRESS_INTERVAL = 1000
+# Long values are cut to this many characters, as `SQLDatabase.run` does.
+MAX_VALUE_LENGTH = 300
+FETCH_BATCH = 256
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _name_key(name):
+    """Compares names the way people misspell them: case, spaces and underscores don't matter."""
+    return re.sub(r"[^0-9a-z]", "", name.lower())
+
+def clean_sql(sql):
+    """Strips markdown fences and trailing semicolons the model sometimes adds."""
+    sql = sql.strip().replace("```sql", "").replace("```", "").strip()
+    return sql.rstrip(";").strip()
+
+def quote_spaced_columns(sql, tables):
+    """
+    Wraps known column names that contain spaces or punctuation in double
+    quotes, and repairs double-quoted names that match exactly one column
+    once case, spaces and underscores are ignored. (SQLite silently treats an
+    unknown double-quoted name as a string literal, so EXPLAIN cannot catch it.)
+    """
+    columns = {col for cols in tables.values() for col in cols}
+    exact = {name.lower() for name in columns | set(tables)}
+    by_key = {}
+    for col in columns:
+        by_key.setdefault(_name_key(col), set()).add(col)
+
+    spaced = sorted((col for col in columns if not re.fullmatch(r"\w+", col)), key=len, reverse=True)
+    # Longest first, so "Task Description Long" wins over "Task Description".
+    pattern = re.compile(
+        r"(?<![\w\"])(" + "|".join(re.escape(n) for n in spaced) + r")(?![\w\"])",
+        re.IGNORECASE,
+    ) if spaced else None
+    canonical = {n.lower(): n for n in spaced}
+
+    def fix_quoted(part):
+        if not part.startswith('"'):
+            return part
+        name = part[1:-1].replace('""', '"')
+        matches = by_key.get(_name_key(name), set())
+        if name.lower() in exact or len(matches) != 1:
+            return part
+        return _quote(next(iter(matches)))
+
+    parts = _QUOTED.split(sql)
+    for i, part in enumerate(parts):
+        if i % 2:
+            parts[i] = fix_quoted(part)
+        elif pattern is not None:
+            parts[i] = pattern.sub(lambda m: _quote(canonical[m.group(1).lower()]), part)
+    return "".join(parts)
+
+def _defines_name(parts, i):
+    """True when the double-quoted part `parts[i]` names an alias or a CTE rather than referring to one."""
+    before = parts[i - 1]
+    if i + 1 < len(parts) and _CTE_NAME_BEFORE.match(parts[i + 1]):
+        return True
+    if not before.strip():
+        # `"Status" "S"`: right after another quoted name.
+        return i >= 2 and bool(before)
+    match = _ALIAS_AFTER.search(before)
+    return bool(match) and (match.group(1) or "").lower() not in _KEYWORDS
+
+def unknown_quoted_names(sql, tables):
+    """
+    The double-quoted names in `sql` that are not a table, a column, a rowid
+    or rank column, or an alias or CTE the query defines. SQLite reads such a name as a
+    string literal, so `WHERE "Assigne" = 'x'` compiles and matches nothing.
+    """
+    parts = _QUOTED.split(sql)
+    quoted = [(i, part[1:-1].replace('""', '"')) for i, part in enumerate(parts) if i % 2 and part.startswith('"')]
+    known = {name.lower() for name in [*tables, *(col for cols in tables.values() for col in cols)]} | _IMPLICIT_NAMES
+    known |= {name.lower() for i, name in quoted if _defines_name(parts, i)}
+    return [name for _, name in quoted if name.lower() not in known]
+
+def _unknown_name_error(name, tables):
+    known = sorted({*tables, *(col for cols in tables.values() for col in cols)})
+    close = difflib.get_close_matches(name, known, n=3, cutoff=0.5)
+    hint = f" Did you mean {', '.join(_quote(c) for c in close)}?" if close else ""
+    return (f"Error: {_quote(name)} is not a table or column, so SQLite would read it as a string.{hint} "
+            "Write text values in single quotes.")
+
+def _rename(sql, wrong, right):
+    """Replaces the identifier `wrong` (bare or double-quoted) with the quoted name `right`."""
+    bare = re.compile(r"(?<![\w\"])" + re.escape(wrong) + r"(?![\w\"])", re.IGNORECASE)
+    parts = _QUOTED.split(sql)
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            parts[i] = bare.sub(lambda m: _quote(right), part)
+        elif part.lower() == _quote(wrong).lower():
+            parts[i] = _quote(right)
+    return "".join(parts)
+
+def _explain(sql, engine):
+    """Compiles the statement without running it. Returns the error message, or None."""
+    connection = engine.raw_connection()
+    try:
+        connection.cursor().execute("EXPLAIN " + sql)
+        return None
+    except sqlite3.Warning:
+        return "You can only execute one statement at a time."
+    except sqlite3.Error as e:
+        return str(e)
+    finally:
+        connection.close()
+
+def _fix_name(sql, error, tables):
+    """
+    Repairs the name in a "no such table/column" error when exactly one known
+    name matches it ignoring case, spaces and underscores. Returns the fixed
+    SQL, or None with a hint listing the closest known names.
+    """
+    match = _NO_SUCH.search(error)
+    if not match:
+        return None, ""
+
+    kind, wrong = match.groups()
+    known = list(tables) if kind == "table" else sorted({c for cols in tables.values() for c in cols})
+    candidates = {name for name in known if _name_key(name) == _name_key(wrong)}
+    if len(candidates) == 1:
+        right = candidates.pop()
+        fixed = _rename(sql, wrong, right)
+        if fixed != sql:
+            print(f"Auto-fixed {kind} name: {wrong} -> {right}")
+            return fixed, ""
+
+    close = difflib.get_close_matches(wrong, known, n=3, cutoff=0.5)
+    if close:
+        return None, f" Did you mean {', '.join(_quote(c) for c in close)}?"
+    if kind == "table":
+        return None, f" The available tables are {', '.join(_quote(t) for t in known)}."
+    return None, ""
+
+def validate_sql(sql, tables, engine):
+    """
+    Cleans, repairs and compiles a generated query on a connection from `engine`.
+
+    `tables` maps table names to their column names (from the cached schema).
+    Returns `(sql, error)`: the possibly fixed query, and an error message
+    starting with "Error:" if it still cannot run.
+    """
+    sql = quote_spaced_columns(clean_sql(sql), tables)
+
+    keyword = sql.split(None, 1)[0].upper() if sql else ""
+    if keyword not in ("SELECT", "WITH"):
+        return sql, "Error: Only a single read-only SELECT statement is allowed."
+    unknown = unknown_quoted_names(sql, tables)
+    if unknown:
+        return sql, _unknown_name_error(unknown[0], tables)
+
+    for _ in range(MAX_NAME_FIXES + 1):
+        error = _explain(sql, engine)
+        if error is None:
+            return sql, None
+        fixed, hint = _fix_name(sql, error, tables)
+        if fixed is None:
+            return sql, f"Error: {error.rstrip('.')}.{hint}"
+        sql = fixed
+
+    return sql, f"Error: {error}"
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > MAX_VALUE_LENGTH:
+        return value[:MAX_VALUE_LENGTH] + "..."
+    return value
+
+def truncate_rows(rows):
+    """Cuts long values the way `run_limited` does by default, keeping rows that need no cut as they are."""
+    return [
+        tuple(_truncate(value) for value in row)
+        if any(isinstance(value, str) and len(value) > MAX_VALUE_LENGTH for value in row) else row
+        for row in rows
+    ]
+
+def _limit_error(limit, timeout, max_rows, max_bytes):
+    if limit == "timeout":
+        return (f"Error: The query was stopped after {timeout:g} seconds. Rewrite it to do less work: "
+                "join on matching keys instead of a cross join, filter earlier, or aggregate.")
+    if limit == "rows":
+        return (f"Error: The query returned more than {max_rows} rows and was truncated. "
+                "Aggregate the rows (COUNT, SUM, GROUP BY) or add a LIMIT.")
+    return (f"Error: The query result exceeded {max_bytes} bytes and was truncated. "
+            "Select fewer columns, aggregate the rows, or add a LIMIT.")
+
+def format_rows(rows):
+    """Renders rows the way `SQLDatabase.run` does, which is what the prompts expect."""
+    return str(rows) if rows else ""
+
+def run_limited(sql, engine, timeout, max_rows, max_bytes, truncate=True):
+    """
+    Executes a query on a connection from `engine`, stopping it once it runs
+    longer than `timeout` seconds or produces more than `max_rows` rows or
+    `max_bytes` bytes of output. Long values are cut to `MAX_VALUE_LENGTH`
+    characters unless `truncate` is false. `max_bytes` counts the rows as
+    kept, so it bounds the memory a result takes either way.
+
+    Returns `(columns, rows, error, limit)`. `error` is None or an "Error:"
+    message; `limit` is None, or "timeout", "rows" or "bytes" when the query
+    was cut short (and `error` says so).
+    """
+    connection = engine.raw_connection()
+    deadline = time.monotonic() + timeout
+    # Returning a true value from the handler makes SQLite abort with "interrupted".
+    connection.driver_connection.set_progress_handler(lambda: time.monotonic() > deadline, PROGRESS_INTERVAL)
+    columns, rows, limit = [], [], None
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql)
+        columns = [description[0] for description in cursor.description or ()]
+        size = 2
+        while limit is None:
+            batch = cursor.fetchmany(FETCH_BATCH)
+            if not batch:
+                break
+            for row in batch:
+                if truncate:
+                    row = tuple(_truncate(value) for value in row)
+                rows.append(row)
+                size += len(repr(row)) + 2
+                if len(rows) > max_rows:
+                    limit = "rows"
+                elif size > max_bytes:
+                    limit = "bytes"
+                if limit:
+                    break
+        cursor.close()
+    except sqlite3.OperationalError as e:
+        if str(e) != "interrupted":
+            return columns, [], f"Error: {e}", None
+        limit = "timeout"
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        return columns, [], f"Error: {e}", None
+    finally:
+        connection.driver_connection.set_progress_handler(None, PROGRESS_INTERVAL)
+        connection.close()
+
+    if limit:
+        return columns, rows, _limit_error(limit, timeout, max_rows, max_bytes), limit
+    return columns, rows, None, None